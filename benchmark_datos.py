@@ -0,0 +1,264 @@
+"""Benchmark del flujo de datos: Excel → encabezados → nombres → cruce con los PDFs.
+
+Genera libros y carpetas de certificados sintéticos (encabezados desordenados, fila de
+encabezado desplazada, nombres con tildes, teléfonos en formatos mezclados, PDFs con
+errores de tipeo o faltantes) y mide tiempo y memoria pico de cada etapa.
+
+    python benchmark_datos.py                                 # 1k y 10k filas
+    python benchmark_datos.py --filas 1000 10000 100000 --json bench_nuevo.json
+    python benchmark_datos.py --comparar bench_anterior.json
+
+Los datos generados se guardan en datos_envio/benchmark y se reutilizan entre corridas.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+
+from enviar_whatsapp import (DATA_DIR, PdfFolderIndex, build_participants, candidate_is_phone_col,
+                             find_header_mapping_from_df, normalize_text, prepare_roster,
+                             read_excel_flexible)
+
+BENCH_DIR = os.path.join(DATA_DIR, "benchmark")
+DEFAULT_ROWS = (1000, 10000)
+PDFS_PER_FOLDER = 500   # certificados por subcarpeta (un "grupo" o aula)
+
+FIRST_NAMES = ["José", "María", "Jesús", "Ángel", "Inés", "Raúl", "Sofía", "Martín", "Lucía", "Andrés",
+               "Verónica", "Iván", "Mónica", "Óscar", "Begoña", "Julián", "Noemí", "Rubén", "Dalia", "Tomás",
+               "Carmen", "Luis", "Rosa", "Pedro", "Ana", "Juan", "Elena", "Hugo", "Pilar", "Jorge",
+               "Gabriela", "Héctor", "Patricia", "Víctor", "Rocío", "Germán", "Araceli", "César", "Nélida", "Efraín"]
+LAST_NAMES = ["Peña", "Muñoz", "Ibáñez", "Núñez", "Gómez", "Pérez", "Rodríguez", "Sánchez", "Ramírez", "Chávez",
+              "Quispe", "Mamani", "Huamán", "Condori", "Flores", "Rojas", "Vásquez", "Castañeda", "Yupanqui", "Díaz",
+              "Torres", "Álvarez", "Gutiérrez", "Ccahuana", "Mendoza", "Salazar", "Cárdenas", "Ñahui", "Zúñiga",
+              "Ortiz", "Benítez", "Villanueva", "Espinoza", "Calderón", "Tapia", "Valdivia", "Huertas", "Cáceres",
+              "Paredes", "León", "Farfán", "Aguirre", "Lozano", "Medina", "Arévalo", "Ticona", "Loayza", "Saavedra"]
+
+# Variantes de encabezado como las que llegan en los Excel reales
+HEADERS = {
+    "NOMBRES": ["Nombres", " NOMBRES ", "Nombre(s)", "nombres del participante", "NOMBRE"],
+    "APELLIDOS": ["Apellidos", "APELLIDOS ", "Apellido Paterno y Materno", "apellidos completos"],
+    "TELEFONO": ["Teléfono", "CELULAR", "Número de WhatsApp", "telefono / celular", "Tel."],
+}
+EXTRA_HEADERS = ["DNI", "Correo electrónico", "Institución", "Fecha de inscripción"]
+
+
+def fake_phone(rng):
+    digits = "9" + "".join(rng.choice("0123456789") for _ in range(8))
+    fmt = rng.randrange(6)
+    if fmt == 0:
+        return digits
+    if fmt == 1:
+        return int(digits)
+    if fmt == 2:
+        return float(digits)          # celdas numéricas guardadas como 987654321.0
+    if fmt == 3:
+        return f"+51 {digits[:3]} {digits[3:6]} {digits[6:]}"
+    if fmt == 4:
+        return f"51-{digits[:3]}-{digits[3:6]}-{digits[6:]}"
+    return f"{digits[:3]} {digits[3:6]} {digits[6:]}"
+
+
+def typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def pdf_filename(nombres, apellidos, rng):
+    kind = rng.random()
+    if kind < 0.50:
+        base = f"{nombres} {apellidos}"
+    elif kind < 0.70:
+        base = f"{apellidos} {nombres}"
+    elif kind < 0.85:
+        base = f"CERTIFICADO - {normalize_text(nombres).title()} {normalize_text(apellidos).title()}"
+    else:
+        words = f"{nombres} {apellidos}".split()
+        j = rng.randrange(len(words))
+        words[j] = typo(words[j], rng)
+        base = " ".join(words)
+    return base + ".pdf"
+
+
+def generate(n_rows, seed=0, base_dir=BENCH_DIR):
+    """Crea (si no existe) el libro y la carpeta de PDFs para n_rows. Devuelve (excel, carpeta)."""
+    target = os.path.join(base_dir, f"filas_{n_rows}_semilla_{seed}")
+    excel = os.path.join(target, "inscritos.xlsx")
+    folder = os.path.join(target, "certificados")
+    if os.path.exists(os.path.join(target, "listo")):
+        return excel, folder
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(folder)
+    rng = random.Random(seed * 1_000_003 + n_rows)
+
+    wb = Workbook(write_only=True)
+    cover = wb.create_sheet("Portada")
+    cover.append(["Certificación del curso"])
+    cover.append(["Resumen de inscritos por aula"])
+    ws = wb.create_sheet("Inscritos")
+    for r in range(rng.randint(1, 5)):   # título, fecha y filas en blanco antes del encabezado
+        ws.append([f"CURSO DE ACTUALIZACIÓN {2020 + r}"] if r % 2 == 0 else [])
+    fields = ["NOMBRES", "APELLIDOS", "TELEFONO"] + EXTRA_HEADERS
+    rng.shuffle(fields)
+    ws.append([rng.choice(HEADERS[f]) if f in HEADERS else f for f in fields])
+
+    written = 0
+    for i in range(n_rows):
+        nombres = " ".join(rng.sample(FIRST_NAMES, rng.choice((1, 2))))
+        apellidos = " ".join(rng.sample(LAST_NAMES, 2))
+        if rng.random() < 0.2:
+            nombres, apellidos = nombres.upper(), f"  {apellidos.upper()} "
+        values = {"NOMBRES": nombres, "APELLIDOS": apellidos, "TELEFONO": fake_phone(rng),
+                  "DNI": f"{rng.randrange(10**7, 10**8)}", "Correo electrónico": f"alumno{i}@correo.pe",
+                  "Institución": rng.choice(["UNSA", "UCSM", "UNSAAC", "I.E. N° 40052"]),
+                  "Fecha de inscripción": f"2024-0{rng.randint(1, 9)}-{rng.randint(10, 28)}"}
+        ws.append([values[f] for f in fields])
+        if rng.random() < 0.97:       # algunos inscritos todavía no tienen certificado
+            sub = os.path.join(folder, f"aula_{written // PDFS_PER_FOLDER:03d}")
+            if written % PDFS_PER_FOLDER == 0:
+                os.makedirs(sub, exist_ok=True)
+            path = os.path.join(sub, pdf_filename(nombres.strip(), apellidos.strip(), rng))
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.4\n%%EOF\n")
+            written += 1
+    wb.save(excel)
+    open(os.path.join(target, "listo"), "w").close()
+    return excel, folder
+
+
+# ---------------------------
+# Medición
+# ---------------------------
+
+def measure(func, memory=True):
+    """Ejecuta func y devuelve (resultado, segundos, MB pico).
+
+    El tiempo se toma sin tracemalloc (lo vuelve varias veces más lento); la memoria
+    pico, en una segunda ejecución con tracemalloc activo.
+    """
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_size(n_rows, seed, memory, log):
+    excel, folder = generate(n_rows, seed)
+    stages = {}
+
+    def stage(name, func):
+        result, secs, peak = measure(func, memory)
+        stages[name] = {"segundos": round(secs, 4), "memoria_mb": None if peak is None else round(peak, 2)}
+        log(f"  {name:<28} {secs:>9.3f} s" + ("" if peak is None else f" {peak:>9.1f} MB"))
+        return result
+
+    df, mapping = stage("read_excel_flexible", lambda: read_excel_flexible(excel))
+    stage("find_header_mapping_from_df", lambda: find_header_mapping_from_df(df))
+    stage("candidate_is_phone_col", lambda: [candidate_is_phone_col(df[c]) for c in df.columns])
+    names = df[mapping["NOMBRES"]].tolist() + df[mapping["APELLIDOS"]].tolist()
+    stage("normalize_text", lambda: [normalize_text(v) for v in names])
+    roster, mapping = stage("prepare_roster", lambda: prepare_roster(df, mapping))
+
+    cache_dir = tempfile.mkdtemp(prefix="bench_indice_")
+    try:
+        def cold_index():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            index = PdfFolderIndex(folder, cache_dir)
+            index.refresh()
+            return index
+        stage("indice_pdfs_frio", cold_index)
+
+        def warm_index():
+            index = PdfFolderIndex(folder, cache_dir)
+            index.refresh()
+            return [path for path, _, _ in index.files()]
+        pdf_files = stage("indice_pdfs_tibio", warm_index)
+        participants, _ = stage("build_participants", lambda: build_participants(roster, mapping, pdf_files))
+
+        def combine_and_refresh():
+            # Lo mismo que App.combine_and_refresh, sin la ventana
+            prepared, m = prepare_roster(df, mapping)
+            return build_participants(prepared, m, warm_index())
+        stage("combine_and_refresh", combine_and_refresh)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    found = sum(p["ENCONTRADO"] for p in participants)
+    log(f"  ({found}/{len(participants)} participantes con PDF)")
+    return stages
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, previous_path, log):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    log(f"\nComparación con {previous_path} (revisión {previous.get('revision') or '?'}):")
+    for size, stages in current["resultados"].items():
+        before = previous["resultados"].get(size)
+        if not before:
+            log(f"  {size} filas: sin datos en la corrida anterior")
+            continue
+        log(f"  {size} filas:")
+        for name, now in stages.items():
+            old = before.get(name)
+            if not old or not old["segundos"]:
+                continue
+            line = f"    {name:<28} x{now['segundos'] / old['segundos']:>6.2f} tiempo"
+            if now["memoria_mb"] and old.get("memoria_mb"):
+                line += f"   x{now['memoria_mb'] / old['memoria_mb']:>6.2f} memoria"
+            log(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de lectura del Excel y cruce con PDFs.")
+    parser.add_argument("--filas", type=int, nargs="+", default=list(DEFAULT_ROWS),
+                        help="tamaños de Excel a medir (por defecto 1000 10000)")
+    parser.add_argument("--semilla", type=int, default=0, help="semilla de los datos sintéticos")
+    parser.add_argument("--sin-memoria", action="store_true", help="no medir memoria pico (corre la mitad)")
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args(argv)
+
+    results = {"revision": git_revision(), "python": platform.python_version(),
+               "fecha": time.strftime("%Y-%m-%d %H:%M:%S"), "resultados": {}}
+    for n in args.filas:
+        print(f"{n} filas:", flush=True)
+        results["resultados"][str(n)] = run_size(n, args.semilla, not args.sin_memoria,
+                                                 lambda m: print(m, flush=True))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.json}")
+    if args.comparar:
+        compare(results, args.comparar, print)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Mide el envío de punta a punta contra el simulador local de WhatsApp Web.
+
+Levanta simulador_whatsapp.py, abre sesiones de Chrome headless contra él y corre
+send_and_report (lo mismo que App.process_sending) con destinatarios y PDFs sintéticos.
+Reporta mensajes por minuto, estados finales y la latencia de cada paso del envío.
+
+    python benchmark_envio.py --mensajes 50 --sesiones 2
+    python benchmark_envio.py --mensajes 100 --fallo-chat 0.1 --escala-plazos 0.2 --json envio.json
+    python benchmark_envio.py --navegacion app --chats-existentes 0.5 --chats-grupo 0.3
+
+--precarga solo acelera cuando el ritmo es lo que limita: compárelo con un ritmo bajo,
+p. ej. --ritmo 20 con y sin --precarga, y mire la espera del ritmo de cada corrida.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import enviar_whatsapp as ew
+from simulador_whatsapp import add_arguments, standin_from_args
+
+NOT_A_STEP = ("PENDIENTE",)  # estados que no marcan un paso del envío (la espera en cola)
+
+
+class TimedJournal(ew.SendJournal):
+    """Diario que además guarda el instante de cada cambio de estado, por destinatario."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.transitions = defaultdict(list)
+
+    def record(self, p, estado, **fields):
+        self.transitions[id(p)].append((estado, time.perf_counter()))
+        super().record(p, estado, **fields)
+
+    def step_latencies(self):
+        """{"PASO_A → PASO_B": [segundos, ...]} a partir de las transiciones consecutivas."""
+        steps = defaultdict(list)
+        for events in self.transitions.values():
+            events = [(s, t) for s, t in events if s not in NOT_A_STEP]
+            for (a, ta), (b, tb) in zip(events, events[1:]):
+                steps[f"{a} → {b}"].append(tb - ta)
+            if events:
+                steps["destinatario completo"].append(events[-1][1] - events[0][1])
+        return steps
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def make_recipients(n, folder):
+    recipients = []
+    for i in range(n):
+        path = os.path.join(folder, f"CERTIFICADO_{i:05d}.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4\n% " + str(i).encode() + b"\n%%EOF\n")
+        name = f"PARTICIPANTE {i:05d}"
+        recipients.append({"NOMBRES": "Participante", "APELLIDOS": f"{i:05d}", "NUM_WA": f"519{i:08d}",
+                           "PDF_PATH": path, "ENCONTRADO": True, "CLAVE": name, "COINCIDENCIA": "EXACTO",
+                           "CONFIANZA": 1.0, "SELECCIONADO": True, "display": name})
+    return recipients
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de envío contra el simulador de WhatsApp Web.")
+    parser.add_argument("--mensajes", type=int, default=20, help="cantidad de destinatarios")
+    parser.add_argument("--sesiones", type=int, default=1, choices=range(1, ew.MAX_SESSIONS + 1))
+    parser.add_argument("--ritmo", type=float, default=600.0,
+                        help="mensajes por minuto por sesión (alto para medir el techo del envío)")
+    parser.add_argument("--escala-plazos", type=float, default=1.0,
+                        help="multiplica STEP_TIMEOUTS y RETRY_BASE_DELAY (p. ej. 0.2 con fallos inyectados)")
+    parser.add_argument("--saludo-en-leyenda", action="store_true", help="saludo como leyenda del PDF")
+    parser.add_argument("--navegacion", choices=("url", "app"), default="url",
+                        help="app: abre los chats existentes desde el buscador (ver --chats-existentes)")
+    parser.add_argument("--precarga", action="store_true",
+                        help="abre el chat siguiente apenas se confirma cada PDF, antes de la espera del ritmo")
+    parser.add_argument("--con-ventana", action="store_true", help="muestra Chrome en lugar de headless")
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    parser.add_argument("-v", "--verbose", action="store_true", help="muestra el registro del envío")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    for step in ew.STEP_TIMEOUTS:
+        ew.STEP_TIMEOUTS[step] = max(1, ew.STEP_TIMEOUTS[step] * args.escala_plazos)
+    ew.RETRY_BASE_DELAY = ew.RETRY_BASE_DELAY * args.escala_plazos
+
+    def log(msg):
+        if args.verbose:
+            print(f"{time.strftime('%H:%M:%S')} - {msg}", flush=True)
+
+    work = tempfile.mkdtemp(prefix="bench_envio_")
+    # Cachés del envío en la carpeta temporal, no en el datos_envio/ de los envíos reales
+    ew.PDF_PREFLIGHT_CACHE = os.path.join(work, "revision_pdfs.json")
+    ew.PDF_OPTIMIZED_DIR = os.path.join(work, "pdf_optimizados")
+    ew.SELECTORS_LEARNED = os.path.join(work, "selectores_aprendidos.json")
+    standin = standin_from_args(args)
+    url = standin.start()
+    print(f"Simulador en {url}")
+    sessions = []
+    try:
+        recipients = make_recipients(args.mensajes, work)
+        sessions = [ew.WhatsAppSession(i, (lambda m, i=i: log(f"[S{i + 1}] {m}")), profile_base=work,
+                                       headless=not args.con_ventana, url=url)
+                    for i in range(args.sesiones)]
+        start = time.perf_counter()
+        for s in sessions:
+            s.open()
+        ready = [s for s in sessions if s.wait_login(30)]
+        startup = time.perf_counter() - start
+        if not ready:
+            print("Ninguna sesión cargó el simulador.")
+            return 1
+
+        journal = TimedJournal(os.path.join(work, "diario.sqlite"))
+        start = time.perf_counter()
+        sent, not_sent = ew.send_and_report(recipients, ready, work, log, lambda *a: None, lambda: False,
+                                            pacing={"rate": args.ritmo, "max_rate": args.ritmo, "jitter": 0.0},
+                                            journal=journal, caption=args.saludo_en_leyenda,
+                                            navigation=args.navegacion, pipeline=args.precarga)
+        elapsed = time.perf_counter() - start
+        # send_and_report deja sus métricas (espera_ritmo, precarga, ...) en la carpeta de trabajo
+        metrics = {}
+        for path in glob.glob(os.path.join(work, "METRICAS_*.json")):
+            with open(path, encoding="utf-8") as f:
+                metrics = json.load(f)
+    finally:
+        for s in sessions:
+            s.quit()
+        standin.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    states = Counter(r["ESTADO"] for r in sent + not_sent)
+    steps = journal.step_latencies()
+    results = {
+        "mensajes": args.mensajes, "sesiones": len(ready), "arranque_s": round(startup, 2),
+        "duracion_s": round(elapsed, 2), "por_minuto": round(len(sent) / elapsed * 60, 1) if elapsed else None,
+        "estados": dict(states), "simulador": dict(standin.stats),
+        "ritmo": {step: metrics.get("pasos", {}).get(step, {}).get("total", 0.0)
+                  for step in ("espera_ritmo", "precarga")},
+        "precargados": metrics.get("contadores", {}).get("navegacion", {}).get("precargado", 0),
+        "pasos": {name: {"n": len(v), "p50": round(percentile(v, 0.5), 3), "p95": round(percentile(v, 0.95), 3),
+                         "max": round(max(v), 3)} for name, v in sorted(steps.items())},
+    }
+
+    print(f"Arranque de {len(ready)} sesiones: {startup:.1f} s")
+    print(f"Envío: {len(sent)}/{args.mensajes} en {elapsed:.1f} s → {results['por_minuto']} mensajes/min")
+    print("Estados: " + ", ".join(f"{k} {v}" for k, v in states.most_common()))
+    print(f"Espera del ritmo: {results['ritmo']['espera_ritmo']:.1f} s en total · precarga "
+          f"{results['ritmo']['precarga']:.1f} s ({results['precargados']} chats precargados)")
+    print("Recibido por el simulador: " + ", ".join(f"{k} {v}" for k, v in sorted(standin.stats.items())))
+    print(f"\n{'paso':<42}{'n':>5}{'p50 s':>9}{'p95 s':>9}{'máx s':>9}")
+    for name, row in results["pasos"].items():
+        print(f"{name:<42}{row['n']:>5}{row['p50']:>9.3f}{row['p95']:>9.3f}{row['max']:>9.3f}")
+    # Con --chats-grupo el buscador puede abrir un grupo: el envío debe notarlo y no escribir ahí
+    misdelivered = {k: v for k, v in standin.stats.items()
+                    if k.startswith("grupo_") and k not in ("grupo_chat", "grupo_busqueda")}
+    if misdelivered:
+        print("⚠️ Mensajes que llegaron a un grupo: " + ", ".join(f"{k} {v}" for k, v in sorted(misdelivered.items())))
+    # WhatsApp Web deja activa una sola pestaña por navegador: abrir otra corta la anterior
+    if standin.stats.get("pestana_inactiva"):
+        print(f"⚠️ Pestañas que quedaron inactivas («Usar aquí»): {standin.stats['pestana_inactiva']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.json}")
+    if misdelivered or standin.stats.get("pestana_inactiva"):
+        return 3
+    return 0 if not not_sent else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
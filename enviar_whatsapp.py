@@ -1,80 +1,2216 @@
 # -*- coding: utf-8 -*-
+import argparse
+import hashlib
+import json
 import os
+import queue
+import itertools
+import math
 import re
+import shutil
+import sqlite3
+import string
+import subprocess
+import sys
 import time
 import threading
 import unicodedata
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, font
+import random
+import heapq
+import contextlib
+import csv
+import io
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox, font
+except ImportError:  # servidor sin Tk: solo queda el modo línea de comandos
+    tk = None
 
+import numpy as np
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.action_chains import ActionChains
-from webdriver_manager.chrome import ChromeDriverManager
+try:
+    import pypdf
+except ImportError:  # sin pypdf la revisión de PDFs es solo estructural y no hay copias comprimidas
+    pypdf = None
+
+# selenium y webdriver_manager se importan recién al abrir un navegador (load_selenium),
+# así --dry-run y los reportes de coincidencias arrancan sin cargarlos.
+webdriver = Service = By = Keys = WebDriverWait = ActionChains = ChromeDriverManager = None
+InvalidSessionIdException = NoSuchWindowException = TimeoutException = WebDriverException = None
+
+def load_selenium():
+    global webdriver, Service, By, Keys, WebDriverWait, ActionChains, ChromeDriverManager
+    global InvalidSessionIdException, NoSuchWindowException, TimeoutException, WebDriverException
+    if webdriver is not None:
+        return
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.common.action_chains import ActionChains
+    from selenium.common.exceptions import (InvalidSessionIdException, NoSuchWindowException, TimeoutException,
+                                            WebDriverException)
+    from webdriver_manager.chrome import ChromeDriverManager
 
 # ---------------------------
 # Utilidades
 # ---------------------------
 
-def normalize_text(s: str) -> str:
-    s = "" if s is None else str(s)
-    s = s.strip()
-    s = unicodedata.normalize("NFKD", s).encode("ASCII", "ignore").decode("ASCII")
-    s = s.upper()
-    s = re.sub(r"[^A-Z0-9\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+class _NormalizeTable(dict):
+    """Tabla de traducción por carácter para normalize_text, se completa bajo demanda.
+
+    Cada carácter se pasa una sola vez por NFKD/ASCII/mayúsculas; lo que no es
+    A-Z o 0-9 se convierte en espacio, igual que la versión con expresiones regulares.
+    """
+
+    def __missing__(self, code):
+        ch = unicodedata.normalize("NFKD", chr(code)).encode("ASCII", "ignore").decode("ASCII").upper()
+        out = "".join(c if ("A" <= c <= "Z" or "0" <= c <= "9") else " " for c in ch)
+        self[code] = out
+        return out
+
+_NORMALIZE_TABLE = _NormalizeTable()
+
+def normalize_text(s: str) -> str:
+    s = "" if s is None else str(s)
+    return " ".join(s.translate(_NORMALIZE_TABLE).split())
+
+def map_distinct(series: pd.Series, func) -> pd.Series:
+    """Aplica func una vez por valor distinto y reparte el resultado a toda la columna."""
+    keys = pd.Series(["" if v is None else str(v) for v in series.tolist()], index=series.index, dtype=object)
+    codes, uniques = pd.factorize(keys)
+    results = np.array([func(u) for u in uniques], dtype=object)
+    return pd.Series(results[codes], index=series.index, dtype=object)
+
+def normalize_series(series: pd.Series) -> pd.Series:
+    """Versión por columna de normalize_text (mismo resultado, memoizado por valor)."""
+    return map_distinct(series, normalize_text)
+
+def candidate_is_phone_col(series: pd.Series) -> bool:
+    cnt = 0
+    checked = 0
+    for v in series.dropna().head(40):
+        checked += 1
+        s = re.sub(r"\D", "", str(v))
+        if 6 <= len(s) <= 13:
+            cnt += 1
+    if checked == 0:
+        return False
+    return (cnt / checked) >= 0.5
+
+def format_peru_phone(raw: str) -> str:
+    tel = re.sub(r"\D", "", str(raw))
+    if tel.startswith("51") and len(tel) == 11:
+        return tel
+    if len(tel) == 9:
+        return "51" + tel
+    if len(tel) == 8:
+        return "51" + tel
+    return tel
+
+def wa_number_ok(num) -> bool:
+    """True si num tiene una cantidad de dígitos posible para WhatsApp (8 a 15)."""
+    return 8 <= len(re.sub(r"\D", "", str(num))) <= 15
+
+def format_phone_series(series: pd.Series) -> pd.Series:
+    """Versión por columna de format_peru_phone (mismo resultado, memoizado por valor)."""
+    return map_distinct(series, format_peru_phone)
+
+def find_header_mapping_from_df(df: pd.DataFrame, col_norm=None):
+    mapping = {"NOMBRES": None, "APELLIDOS": None, "TELEFONO": None}
+    if col_norm is None:
+        col_norm = {c: normalize_text(c) for c in df.columns}
+    for c, nc in col_norm.items():
+        if ("NOMB" in nc or "NAME" in nc or "NOMBRE" in nc) and mapping["NOMBRES"] is None:
+            mapping["NOMBRES"] = c
+        if ("APELL" in nc or "LAST" in nc or "APELLIDO" in nc) and mapping["APELLIDOS"] is None:
+            mapping["APELLIDOS"] = c
+        if any(k in nc for k in ("TEL", "CEL", "NUM", "PHONE")) and mapping["TELEFONO"] is None:
+            mapping["TELEFONO"] = c
+
+    if mapping["TELEFONO"] is None:
+        for c in df.columns:
+            try:
+                if candidate_is_phone_col(df[c]):
+                    mapping["TELEFONO"] = c
+                    break
+            except Exception:
+                continue
+
+    return mapping
+
+HEADER_SCAN_ROWS = 8  # filas iniciales donde se busca el encabezado
+
+def header_row_flags(cells):
+    """Indica si una fila contiene encabezados de nombre, apellido y teléfono."""
+    norm = [normalize_text(c) for c in cells if c is not None]
+    has_name = any("NOMB" in v or "NOMBRE" in v or "NAME" in v for v in norm)
+    has_ap = any("APELL" in v or "APELLIDO" in v or "LAST" in v for v in norm)
+    has_tel = any("TEL" in v or "CEL" in v or "NUM" in v or "PHONE" in v for v in norm)
+    return has_name, has_ap, has_tel
+
+def detect_header_row(rows):
+    """Devuelve (índice, puntaje) de la fila de encabezado entre las primeras filas."""
+    for r, row in enumerate(rows[:HEADER_SCAN_ROWS]):
+        has_name, has_ap, has_tel = header_row_flags(row)
+        if (has_name and has_ap) or has_tel:
+            return r, has_name + has_ap + has_tel
+    return None, 0
+
+def frame_from_rows(rows, header_row_index):
+    """Arma el DataFrame nombrando columnas como pd.read_excel (Unnamed, duplicados) y sin filas vacías.
+
+    A diferencia de pd.read_excel, los valores quedan como vienen de la celda: un DNI o
+    teléfono guardado como texto sigue siendo texto (con sus ceros a la izquierda), no número.
+    """
+    rows = rows[header_row_index:]
+    width = 0
+    for row in rows:
+        for j in range(len(row) - 1, -1, -1):
+            if row[j] is not None:
+                width = max(width, j + 1)
+                break
+    header = list(rows[0]) if rows else []
+    columns, seen = [], {}
+    for i in range(width):
+        name = header[i] if i < len(header) and header[i] is not None else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    data = []
+    for row in rows[1:]:
+        row = list(row[:width])
+        if all(v is None for v in row):
+            continue
+        row.extend([None] * (width - len(row)))
+        data.append(row)
+    return pd.DataFrame(data, columns=columns)
+
+def iter_sheet_rows(path):
+    """Itera (nombre_hoja, iterador_de_filas) leyendo el libro una sola vez."""
+    if path.lower().endswith(".xls"):
+        # openpyxl no lee .xls: una única lectura cruda con pandas por hoja
+        for name, raw in pd.read_excel(path, header=None, sheet_name=None).items():
+            yield name, iter(raw.astype(object).where(raw.notna(), None).values.tolist())
+        return
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.title, ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def read_excel_flexible(path):
+    """Lee el Excel en una sola pasada y detecta hoja y fila de encabezado."""
+    best = None
+    sheets = iter_sheet_rows(path)
+    try:
+        for name, rows_iter in sheets:
+            buffered = []
+            for row in rows_iter:
+                buffered.append(row)
+                if len(buffered) >= HEADER_SCAN_ROWS:
+                    break
+            header_row_index, score = detect_header_row(buffered)
+            if best is None or score > best[0]:
+                best = (score, name, header_row_index, buffered, rows_iter)
+            if score == 3:
+                break
+        if best is None:
+            return pd.DataFrame(), find_header_mapping_from_df(pd.DataFrame())
+        score, name, header_row_index, rows, rows_iter = best
+        rows.extend(rows_iter)
+    finally:
+        sheets.close()
+
+    df = frame_from_rows(rows, header_row_index or 0)
+    df.attrs["sheet"] = name
+    return df, find_header_mapping_from_df(df)
+
+# ---------------------------
+# Índice de carpeta de PDFs
+# ---------------------------
+
+DATA_DIR = os.path.join(os.getcwd(), "datos_envio")  # cachés e índices locales de la app
+
+class PdfFolderIndex:
+    """Índice persistente (nombre, tamaño, mtime) de los PDFs de una carpeta y sus subcarpetas.
+
+    Solo se vuelve a listar con os.scandir una carpeta cuyo mtime cambió desde la última
+    actualización; el resto se toma del índice guardado en DATA_DIR. Un PDF sobrescrito
+    sin cambiar el mtime de su carpeta conserva el tamaño y mtime anteriores en el índice:
+    el índice solo decide qué archivos hay, y PdfPreflight y pdf_hash vuelven a consultar
+    cada uno con os.stat.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root, cache_dir=DATA_DIR):
+        self.root = os.path.abspath(root)
+        key = hashlib.sha1(self.root.encode("utf-8")).hexdigest()[:16]
+        self.cache_path = os.path.join(cache_dir, f"indice_pdfs_{key}.json")
+        self.dirs = self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION and data.get("root") == self.root:
+                return data["dirs"]
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "root": self.root, "dirs": self.dirs}, f)
+        os.replace(tmp, self.cache_path)
+
+    def _scan_dir(self, rel, mtime):
+        entry = {"mtime": mtime, "files": {}, "subdirs": []}
+        subdirs = []
+        with os.scandir(os.path.join(self.root, rel)) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        entry["subdirs"].append(e.name)
+                        subdirs.append((os.path.join(rel, e.name), e.stat(follow_symlinks=False).st_mtime_ns))
+                    elif e.name.lower().endswith(".pdf") and e.is_file():
+                        st = e.stat()
+                        entry["files"][e.name] = [st.st_size, st.st_mtime_ns]
+                except OSError:
+                    continue
+        return entry, subdirs
+
+    def refresh(self, force=False):
+        """Actualiza y guarda el índice. Devuelve (carpetas revisadas, carpetas releídas)."""
+        dirs = {}
+        rescanned = 0
+        stack = [("", os.stat(self.root).st_mtime_ns)]
+        while stack:
+            rel, mtime = stack.pop()
+            cached = self.dirs.get(rel)
+            try:
+                if not force and cached is not None and cached["mtime"] == mtime:
+                    # Carpeta sin cambios: solo hace falta el mtime de sus subcarpetas
+                    entry, subdirs = cached, []
+                    for name in cached["subdirs"]:
+                        sub = os.path.join(rel, name)
+                        subdirs.append((sub, os.stat(os.path.join(self.root, sub)).st_mtime_ns))
+                else:
+                    entry, subdirs = self._scan_dir(rel, mtime)
+                    rescanned += 1
+            except OSError:
+                # Desapareció a mitad de camino: se relee completa en la próxima actualización
+                continue
+            dirs[rel] = entry
+            stack.extend(subdirs)
+        self.dirs = dirs
+        self.save()
+        return len(dirs), rescanned
+
+    def files(self):
+        """Itera (ruta, tamaño, mtime_ns) de todos los PDFs indexados."""
+        for rel, entry in self.dirs.items():
+            base = os.path.join(self.root, rel) if rel else self.root
+            for name, (size, mtime) in entry["files"].items():
+                yield os.path.join(base, name), size, mtime
+
+    def __len__(self):
+        return sum(len(entry["files"]) for entry in self.dirs.values())
+
+# ---------------------------
+# Coincidencia PDF ↔ Excel
+# ---------------------------
+
+MATCH_MIN_SCORE = 0.75      # confianza mínima para aceptar una coincidencia
+MATCH_AMBIGUOUS_GAP = 0.05  # si el segundo candidato queda a menos de esto, es ambiguo
+FUZZY_MAX_EDITS = 1         # errores de tipeo (Damerau-Levenshtein) tolerados por palabra
+FUZZY_MIN_LEN = 4           # las palabras más cortas solo coinciden exactas
+FUZZY_MAX_ALTERNATIVES = 3
+# Palabras de relleno en los nombres de archivo; solo se ignoran si no aparecen en el Excel
+FILENAME_NOISE_WORDS = frozenset({"CERTIFICADO", "CERTIFICADOS", "CONSTANCIA", "DIPLOMA", "DE", "DEL", "LA",
+                                  "EL", "Y", "PARA", "FINAL", "COPIA", "PDF"})
+
+def _bigrams(token):
+    t = f" {token} "
+    return frozenset(t[i:i + 2] for i in range(len(t) - 1))
+
+def edit_distance(a, b, limit):
+    """Distancia de Damerau-Levenshtein (transposiciones adyacentes) entre a y b, o limit + 1 si la supera."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class RosterIndex:
+    """Índice invertido de palabras y bigramas sobre NOMBRES_CL/APELLIDOS_CL.
+
+    Cada PDF se compara solo contra las filas que comparten alguna palabra (exacta o
+    parecida) con su nombre de archivo, en lugar de contra todo el Excel. Una coincidencia
+    aproximada exige al menos un nombre y un apellido de la fila.
+    """
+
+    def __init__(self, nombres, apellidos):
+        self.keys = []
+        self.row_tokens = []
+        self.row_parts = []  # (palabras del nombre, palabras del apellido)
+        self.by_key = {}
+        self.postings = {}
+        for i, (n, a) in enumerate(zip(nombres, apellidos)):
+            key = f"{n} {a}".strip()
+            tokens = frozenset(key.split())
+            self.keys.append(key)
+            self.row_tokens.append(tokens)
+            self.row_parts.append((frozenset(str(n).split()), frozenset(str(a).split())))
+            self.by_key.setdefault(key, []).append(i)
+            for t in tokens:
+                self.postings.setdefault(t, []).append(i)
+        self._grams = None
+        self._alt_cache = {}
+        self._sets = {}
+
+    def _build_grams(self):
+        # (bigrama, longitud) -> palabras del vocabulario; la longitud acota la búsqueda
+        self._grams = {}
+        for t in self.postings:
+            if len(t) < FUZZY_MIN_LEN:
+                continue
+            for g in _bigrams(t):
+                self._grams.setdefault((g, len(t)), []).append(t)
+
+    def alternatives(self, token):
+        """Palabras del Excel que pueden corresponder a token, con su similitud.
+
+        Los bigramas solo proponen candidatos; se acepta el que está a FUZZY_MAX_EDITS
+        ediciones o menos (una letra de más, de menos, cambiada o dos letras invertidas).
+        """
+        if token in self.postings:
+            return ((token, 1.0),)
+        if len(token) < FUZZY_MIN_LEN:
+            return ()
+        cached = self._alt_cache.get(token)
+        if cached is not None:
+            return cached
+        if self._grams is None:
+            self._build_grams()
+        grams = _bigrams(token)
+        shared = Counter()
+        for length in range(len(token) - FUZZY_MAX_EDITS, len(token) + FUZZY_MAX_EDITS + 1):
+            if length < FUZZY_MIN_LEN:
+                continue
+            for g in grams:
+                shared.update(self._grams.get((g, length), ()))
+        # Cada edición cambia a lo sumo 3 bigramas: cota para descartar sin calcular la distancia
+        min_shared = max(1, len(grams) - 3 * FUZZY_MAX_EDITS)
+        scored = []
+        for t in [t for t, n in shared.items() if n >= min_shared]:
+            dist = edit_distance(token, t, FUZZY_MAX_EDITS)
+            if dist <= FUZZY_MAX_EDITS:
+                scored.append((1 - dist / max(len(token), len(t)), t))
+        scored.sort(reverse=True)
+        result = tuple((t, sim) for sim, t in scored[:FUZZY_MAX_ALTERNATIVES])
+        self._alt_cache[token] = result
+        return result
+
+    def _rows_for(self, alts):
+        if len(alts) == 1:
+            return self._posting_set(alts[0][0])
+        return frozenset().union(*(self._posting_set(t) for t, _ in alts))
+
+    def _posting_set(self, token):
+        s = self._sets.get(token)
+        if s is None:
+            s = self._sets[token] = frozenset(self.postings[token])
+        return s
+
+    def score(self, row, query):
+        """Confianza 0..1 de que la fila corresponda a las palabras del PDF."""
+        tokens = self.row_tokens[row]
+        if not tokens or not query:
+            return 0.0
+        matched = 0.0
+        for alts in query.values():
+            matched += max((sim for t, sim in alts if t in tokens), default=0.0)
+        return 0.75 * matched / len(query) + 0.25 * min(1.0, matched / len(tokens))
+
+    def covers(self, row, query):
+        """True si las palabras del PDF incluyen un nombre y un apellido de la fila.
+
+        Si la fila no separa nombre y apellido (una de las columnas vacía), se piden dos palabras.
+        """
+        tokens = self.row_tokens[row]
+        hits = {t for alts in query.values() for t, _ in alts if t in tokens}
+        names, surnames = self.row_parts[row]
+        if names and surnames:
+            return bool(hits & names) and bool(hits & surnames)
+        return len(hits) >= 2
+
+    def match(self, filename):
+        """Devuelve (fila, confianza, estado, candidatos) para un nombre de PDF."""
+        key = normalize_text(os.path.splitext(os.path.basename(filename))[0])
+        rows = self.by_key.get(key) if key else None
+        if rows:
+            if len(rows) == 1:
+                return rows[0], 1.0, "EXACTO", rows
+            return None, 1.0, "AMBIGUO", rows
+
+        # Las palabras sin equivalencia en el Excel siguen contando en el denominador: un
+        # "Carlos Quispe" que no está en la lista no debe coincidir con "Rosa Quispe".
+        # Solo se ignoran los números y el relleno (FILENAME_NOISE_WORDS) que no está en el Excel.
+        query = {}
+        for t in key.split():
+            if t.isdigit():
+                continue
+            alts = self.alternatives(t)
+            if alts or t not in FILENAME_NOISE_WORDS:
+                query[t] = alts
+        if not any(query.values()):
+            return None, 0.0, "SIN_COINCIDENCIA", []
+
+        # Para llegar a MATCH_MIN_SCORE una fila debe contener al menos `need` de las palabras
+        # del PDF, así que basta con intersecar sus conjuntos de filas (operaciones en C).
+        need = max(1, math.ceil((MATCH_MIN_SCORE - 0.25) / 0.75 * len(query) - 1e-9))
+        sets = sorted((self._rows_for(alts) for alts in query.values() if alts), key=len)
+        candidates = set()
+        for combo in itertools.combinations(sets, need):
+            hit = combo[0].intersection(*combo[1:])
+            candidates.update(hit)
+        if not candidates:
+            return None, 0.0, "SIN_COINCIDENCIA", []
+
+        scored = sorted(((self.score(r, query), r) for r in candidates if self.covers(r, query)), reverse=True)
+        if not scored:
+            return None, 0.0, "SIN_COINCIDENCIA", []
+        best_score, best_row = scored[0]
+        if best_score < MATCH_MIN_SCORE:
+            return None, best_score, "SIN_COINCIDENCIA", []
+        tied = [r for s, r in scored if best_score - s < MATCH_AMBIGUOUS_GAP]
+        if len(tied) > 1:
+            return None, best_score, "AMBIGUO", sorted(tied)
+        return best_row, best_score, "PROBABLE", [best_row]
+
+def match_pdfs_to_roster(df: pd.DataFrame, pdf_paths):
+    """Asigna a cada fila de df el PDF que mejor le corresponde.
+
+    Devuelve un DataFrame alineado con df (PDF, PATH, COINCIDENCIA, CONFIANZA) y la
+    lista de PDFs no asignados (ambiguos, sin coincidencia o duplicados) para el registro.
+    """
+    index = RosterIndex(df["NOMBRES_CL"].tolist(), df["APELLIDOS_CL"].tolist())
+    best = {}
+    report = []
+    for path in sorted(pdf_paths):
+        row, score, status, candidates = index.match(path)
+        if row is None:
+            report.append({"PDF": os.path.basename(path), "ESTADO": status, "CONFIANZA": score,
+                           "CANDIDATOS": [index.keys[r] for r in candidates]})
+            continue
+        prev = best.get(row)
+        if prev is not None and (score, status == "EXACTO") <= (prev[1], prev[2] == "EXACTO"):
+            report.append({"PDF": os.path.basename(path), "ESTADO": "DUPLICADO", "CONFIANZA": score,
+                           "CANDIDATOS": [index.keys[row]]})
+            continue
+        if prev is not None:
+            report.append({"PDF": os.path.basename(prev[0]), "ESTADO": "DUPLICADO", "CONFIANZA": prev[1],
+                           "CANDIDATOS": [index.keys[row]]})
+        best[row] = (path, score, status)
+
+    n = len(df)
+    pdf, paths, status, conf = [""] * n, [""] * n, ["SIN_PDF"] * n, [0.0] * n
+    for row, (path, score, st) in best.items():
+        pdf[row], paths[row], status[row], conf[row] = os.path.basename(path), path, st, score
+    result = pd.DataFrame({"PDF": pdf, "PATH": paths, "COINCIDENCIA": status, "CONFIANZA": conf}, index=df.index)
+    return result, report
+
+# ---------------------------
+# Sesiones de WhatsApp Web
+# ---------------------------
+
+WHATSAPP_URL = "https://web.whatsapp.com"
+PROFILE_BASENAME = "whatsapp_profile_v8"
+MAX_SESSIONS = 4           # WhatsApp admite hasta 4 dispositivos vinculados por cuenta
+MAX_SESSION_FAILURES = 3   # fallos seguidos antes de dar por caída una sesión
+MAX_ATTEMPTS = 3           # intentos por destinatario ante fallos transitorios
+RETRY_BASE_DELAY = 30      # segundos antes del primer reintento; se duplica en cada uno
+
+# Clasificación de fallos de send_to. Los transitorios vuelven a la cola de reintentos;
+# los definitivos no se reintentan. SIN_CONFIRMAR tampoco: el PDF podría llegar igual
+# y reenviarlo lo duplicaría. Por eso send_group solo devuelve ERROR:... antes del clic en
+# enviar; un error posterior deja SIN_CONFIRMAR.
+PERMANENT_FAILURES = {"PDF_NO", "NUMERO_INVALIDO", "PDF_CORRUPTO", "PDF_CIFRADO", "PDF_GRANDE"}
+TRANSIENT_FAILURES = {"TIMEOUT_CHAT", "ERROR_ADJUNTO", "ERROR_BOTON_ENVIAR"}
+
+# Estados del diario en los que el PDF pudo haber salido: clic en enviar sin cierre de la
+# vista previa registrado, PDF en camino o sin marca de enviado. Al reanudar no se
+# reenvían solos (se duplicaría el certificado); se listan para que el usuario decida.
+IN_DOUBT_STATES = {"ADJUNTANDO_PDF", "PDF_EN_CAMINO", "SIN_CONFIRMAR"}
+
+def is_transient_failure(estado):
+    return estado in TRANSIENT_FAILURES or estado.startswith("ERROR:")
+
+# Tiempo máximo (s) de cada paso del envío; se avanza en cuanto el DOM lo permite
+STEP_TIMEOUTS = {
+    "chat": 20,        # carga del chat (aparece la caja de texto)
+    "search": 5,       # el buscador abre un chat existente (si no, se recarga con /send)
+    "text": 10,        # el saludo sale y la caja de texto queda vacía
+    "attach": 5,       # el menú de adjuntar expone el input de archivo
+    "preview": 20,     # la vista previa del PDF muestra el botón enviar
+    "upload": 30,      # la vista previa se cierra tras enviar
+    "confirm": 60,     # el mensaje saliente pasa del reloj a la marca de enviado
+}
+
+# Navegación dentro de WhatsApp Web (buscador) en lugar de recargar con /send
+APP_NAV_GIVE_UP = 5  # búsquedas fallidas seguidas, sin ningún acierto, antes de usar solo /send
+
+# Diálogo que muestra WhatsApp Web cuando el número del enlace /send no tiene cuenta
+INVALID_NUMBER_XPATH = ('//div[@role="dialog"]//*[contains(text(), "no es válido") '
+                        'or contains(text(), "is invalid")]')
+
+# Espera una condición del DOM con un MutationObserver, en un solo viaje a WebDriver.
+# Las condiciones están escritas aquí (no se evalúa código) por la CSP de WhatsApp Web.
+# La caja de texto y el botón enviar se buscan con los selectores de SelectorBook
+# (arguments[3]: {rol: [xpath, ...]} de DOM_WAIT_ROLES).
+DOM_WAIT_JS = r"""
+const name = arguments[0], timeoutMs = arguments[1], param = arguments[2], selectors = arguments[3];
+const done = arguments[arguments.length - 1];
+const visible = el => el && el.offsetParent !== null;
+const byRole = (role, mustBeVisible) => {
+    for (const xpath of selectors[role]) {
+        const found = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (let i = 0; i < found.snapshotLength; i++) {
+            if (!mustBeVisible || visible(found.snapshotItem(i))) return found.snapshotItem(i);
+        }
+    }
+    return null;
+};
+const textbox = () => byRole('caja_texto', false);
+const sendButton = () => byRole('enviar', true);
+const conditions = {
+    chat_ready: () => !!textbox(),
+    // Chat 1:1 abierto y verificado: tiene mensajes de ese número (data-id "true_/false_<número>@c.us_…").
+    // En un grupo el id termina en "_<número>@c.us" y no debe contar.
+    chat_for: () => !!textbox() && !!document.querySelector(
+        `#main [data-id^="true_${param}@c.us_"], #main [data-id^="false_${param}@c.us_"]`),
+    text_sent: () => !!textbox() && textbox().textContent.trim() === '',
+    file_input: () => !!document.querySelector('input[type="file"]'),
+    preview_ready: () => !!sendButton(),
+    // `param` es el botón enviar en el que se hizo clic: tiene que desaparecer él, no
+    // basta con que los selectores no vean ninguno
+    preview_closed: () => !!param && (!param.isConnected || !visible(param)) && !sendButton(),
+    // Último mensaje saliente distinto de `param` y ya sin el ícono de reloj
+    outgoing_acked: () => {
+        const outs = document.querySelectorAll('div.message-out');
+        const el = outs.length ? outs[outs.length - 1] : null;
+        const row = el && el.closest('[data-id]');
+        if (!el || (row ? row.getAttribute('data-id') : '') === param) return null;
+        for (const icon of ['msg-dblcheck-ack', 'msg-dblcheck', 'msg-check']) {
+            if (el.querySelector(`span[data-icon="${icon}"]`)) return icon;
+        }
+        return null;
+    },
+};
+const check = conditions[name];
+let finished = false;
+const finish = value => { if (!finished) { finished = true; obs.disconnect(); clearTimeout(timer); done(value); } };
+const obs = new MutationObserver(() => { const value = check(); if (value) finish(value); });
+const timer = setTimeout(() => finish(check() || false), timeoutMs);
+const first = check();
+if (first) { finish(first); }
+else { obs.observe(document.body, {childList: true, subtree: true, attributes: true, characterData: true}); }
+"""
+
+# data-id de la fila del último mensaje saliente ("" si no hay): referencia para outgoing_acked
+LAST_OUTGOING_JS = """
+const outs = document.querySelectorAll('div.message-out');
+const row = outs.length ? outs[outs.length - 1].closest('[data-id]') : null;
+return row ? row.getAttribute('data-id') : '';
+"""
+
+# Selectores XPath de cada elemento de la interfaz, en orden de preferencia. Se toman de
+# SELECTORS_FILE si existe (un cambio del DOM de WhatsApp se corrige editando ese archivo);
+# estos quedan como respaldo. El que acierta se recuerda en SELECTORS_LEARNED.
+DEFAULT_SELECTORS = {
+    "buscador": [
+        '//div[@contenteditable="true"][@data-tab="3"]',
+        '//div[@id="side"]//div[@contenteditable="true"][@role="textbox"]',
+        '//div[@contenteditable="true"][@aria-label="Buscar un chat o iniciar uno nuevo"]',
+        '//div[@contenteditable="true"][@aria-label="Search or start new chat"]',
+    ],
+    "caja_texto": [
+        '//div[@contenteditable="true"][@data-tab="10"]',
+        '//footer//div[@contenteditable="true"][@role="textbox"]',
+        '//div[@contenteditable="true"][@aria-placeholder="Escribe un mensaje"]',
+        '//div[@contenteditable="true"][@aria-placeholder="Type a message"]',
+    ],
+    "enviar_texto": [
+        '//button[@data-tab="11"]',
+        '//footer//span[@data-icon="send"]/..',
+        '//footer//button[@aria-label="Enviar"]',
+        '//footer//button[@aria-label="Send"]',
+    ],
+    "adjuntar": [
+        '//div[@title="Adjuntar"]',
+        '//button[@data-testid="clip"]',
+        '//span[@data-icon="clip"]/..',
+        '//div[@aria-label="Adjuntar"]',
+    ],
+    "input_archivo": [
+        '//input[@accept="*"][@type="file"]',
+        '//input[@type="file"]',
+    ],
+    "enviar": [
+        '//span[@data-icon="send"]/..',
+        '//button[@data-testid="send"]',
+        '//div[@aria-label="Enviar"]',
+        '//span[@data-testid="send"]/..',
+    ],
+    "leyenda": [
+        '//div[@contenteditable="true"][@aria-label="Añade un comentario"]',
+        '//div[@contenteditable="true"][@aria-placeholder="Añade un comentario"]',
+        '//div[@contenteditable="true"][@aria-label="Add a caption"]',
+        '//div[@contenteditable="true"][@aria-placeholder="Add a caption"]',
+    ],
+}
+SELECTORS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "selectores_whatsapp.json")
+SELECTORS_LEARNED = os.path.join(DATA_DIR, "selectores_aprendidos.json")
+DOM_WAIT_ROLES = ("caja_texto", "enviar")  # elementos que DOM_WAIT_JS recibe como selectores
+
+# Prueba todos los selectores de un elemento en un solo viaje a WebDriver.
+# Devuelve [índice, elemento] del primero que cumple `need`, o null.
+RESOLVE_JS = """
+const xpaths = arguments[0], need = arguments[1];
+for (let i = 0; i < xpaths.length; i++) {
+    const found = document.evaluate(xpaths[i], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (let j = 0; j < found.snapshotLength; j++) {
+        const el = found.snapshotItem(j);
+        if (need === 'present') return [i, el];
+        if (el.offsetParent === null) continue;
+        if (need === 'enabled' && (el.disabled || el.getAttribute('aria-disabled') === 'true')) continue;
+        return [i, el];
+    }
+}
+return null;
+"""
+
+class SelectorBook:
+    """Selectores por elemento (SELECTORS_FILE) y el último que acertó en cada uno.
+
+    Lo aprendido se guarda junto con la versión del archivo de selectores: si el archivo
+    cambia de versión, se descarta y se vuelve al orden del archivo.
+    """
+
+    def __init__(self, path=SELECTORS_FILE, learned_path=None):
+        self.learned_path = learned_path or SELECTORS_LEARNED
+        self.version = "interna"
+        self.roles = {role: list(xpaths) for role, xpaths in DEFAULT_SELECTORS.items()}
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.roles.update({role: list(xpaths) for role, xpaths in data["selectores"].items() if xpaths})
+            self.version = str(data.get("version", "sin versión"))
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        self.learned = {}
+        try:
+            with open(self.learned_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.learned = {role: xpath for role, xpath in data["ganadores"].items()
+                                if xpath in self.roles.get(role, ())}
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        self._lock = threading.Lock()
+
+    def candidates(self, role, preferred=None):
+        """Selectores del elemento, con el preferido (o el aprendido) primero."""
+        xpaths = self.roles[role]
+        first = preferred if preferred in xpaths else self.learned.get(role)
+        return [first] + [x for x in xpaths if x != first] if first else list(xpaths)
+
+    def learn(self, role, xpath):
+        """Recuerda el selector que acertó; solo escribe el archivo si cambió."""
+        with self._lock:
+            if self.learned.get(role) == xpath:
+                return
+            self.learned[role] = xpath
+            try:
+                os.makedirs(os.path.dirname(self.learned_path), exist_ok=True)
+                tmp = self.learned_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"version": self.version, "ganadores": self.learned}, f, indent=2, ensure_ascii=False)
+                os.replace(tmp, self.learned_path)
+            except OSError:
+                pass
+
+_selector_book = None
+_selector_book_lock = threading.Lock()
+
+def selector_book():
+    """SelectorBook compartido por todas las sesiones del proceso."""
+    global _selector_book
+    with _selector_book_lock:
+        if _selector_book is None:
+            _selector_book = SelectorBook()
+        return _selector_book
+
+CHROMEDRIVER_CACHE = os.path.join(DATA_DIR, "chromedriver.json")
+PRELAUNCH_BROWSER = True   # por defecto, Chrome arranca en segundo plano mientras se elige el Excel
+
+def installed_chrome_version():
+    """Versión de Chrome instalada, consultada localmente (sin red). None si no se detecta."""
+    if sys.platform.startswith("win"):
+        import winreg
+        for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(root, r"Software\Google\Chrome\BLBeacon") as key:
+                    return winreg.QueryValueEx(key, "version")[0]
+            except OSError:
+                continue
+        return None
+    if sys.platform == "darwin":
+        candidates = ["/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"]
+    else:
+        candidates = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser"]
+    for exe in candidates:
+        try:
+            out = subprocess.run([exe, "--version"], capture_output=True, text=True, timeout=10).stdout
+        except (OSError, subprocess.SubprocessError):
+            continue
+        m = re.search(r"\d+\.\d+\.\d+\.\d+", out)
+        if m:
+            return m.group(0)
+    return None
+
+_chromedriver_lock = threading.Lock()  # las sesiones arrancan en paralelo (launch_async)
+
+def resolve_chromedriver(log):
+    """Ruta del chromedriver, reutilizando la guardada si corresponde a la versión mayor de Chrome.
+
+    ChromeDriverManager (que consulta la red) solo se usa si no hay caché, si Chrome cambió
+    de versión mayor o si el binario guardado ya no existe. Sin red, se reutiliza lo que haya.
+    """
+    with _chromedriver_lock:
+        chrome = installed_chrome_version()
+        major = chrome.split(".")[0] if chrome else None
+        try:
+            with open(CHROMEDRIVER_CACHE, encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        cached_path = cached.get("driver_path")
+        usable = bool(cached_path) and os.path.isfile(cached_path)
+        if usable and (major is None or cached.get("chrome_major") == major):
+            return cached_path
+
+        try:
+            path = ChromeDriverManager().install()
+        except Exception as e:
+            if usable:
+                log(f"No se pudo verificar chromedriver en línea ({e}); se usa el guardado.")
+                return cached_path
+            raise
+        try:
+            os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE), exist_ok=True)
+            tmp = CHROMEDRIVER_CACHE + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"chrome_version": chrome, "chrome_major": major, "driver_path": path,
+                           "resuelto": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+            os.replace(tmp, CHROMEDRIVER_CACHE)
+        except OSError:
+            pass  # sin caché solo se vuelve a consultar la próxima vez
+        return path
+
+# Perfil liviano: del perfil de Chrome solo importan la sesión de WhatsApp (IndexedDB,
+# Local Storage, Service Worker, cookies) y las preferencias. Estas cachés se regeneran
+# solas y se borran antes de cada arranque. CertificateRevocation (la lista de certificados
+# revocados) no es una caché y no se toca: con --disable-component-update no se volvería a bajar.
+PROFILE_PRUNE = (
+    "GrShaderCache", "GraphiteDawnCache", "ShaderCache", "optimization_guide_model_store",
+    "component_crx_cache", "extensions_crx_cache", "segmentation_platform", "Crashpad",
+    "MediaFoundationWidevineCdm", "Subresource Filter", "chrome_debug.log",
+    os.path.join("Default", "Cache"), os.path.join("Default", "Code Cache"), os.path.join("Default", "GPUCache"),
+    os.path.join("Default", "DawnGraphiteCache"), os.path.join("Default", "DawnWebGPUCache"),
+    os.path.join("Default", "optimization_guide_hint_cache_store"), os.path.join("Default", "Shared Dictionary"),
+    os.path.join("Default", "Segmentation Platform"), os.path.join("Default", "Download Service"),
+    os.path.join("Default", "AutofillAiModelCache"), os.path.join("Default", "BrowsingTopicsSiteData"),
+)
+PROFILE_LOCKS = ("SingletonLock", "lockfile")  # Chrome está usando el perfil: no se toca
+
+# Opciones de Chrome para varias sesiones en una máquina modesta: sin extensiones,
+# componentes ni cachés de GPU, y sin frenar las ventanas que quedan detrás.
+LEAN_CHROME_ARGS = (
+    "--disable-extensions",
+    "--disable-component-update",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-gpu",
+    "--disable-gpu-shader-disk-cache",
+    "--disk-cache-size=33554432",
+    "--disable-features=OptimizationHints,OptimizationGuideModelDownloading,MediaRouter,Translate",
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+)
+LEAN_PROFILE = True    # perfil podado y LEAN_CHROME_ARGS (WhatsAppSession.lean)
+BLOCK_IMAGES = False   # no descargar imágenes (fotos de perfil, vistas previas); WhatsAppSession.block_images
+
+def dir_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(folder, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def prune_profile(profile_dir):
+    """Borra las cachés de PROFILE_PRUNE del perfil; conserva el inicio de sesión.
+
+    Devuelve los bytes liberados, o None si Chrome tiene el perfil abierto.
+    """
+    if any(os.path.lexists(os.path.join(profile_dir, lock)) for lock in PROFILE_LOCKS):
+        return None
+    freed = 0
+    for rel in PROFILE_PRUNE:
+        path = os.path.join(profile_dir, rel)
+        if os.path.isdir(path) and not os.path.islink(path):
+            freed += dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.isfile(path):
+            freed += os.path.getsize(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return freed
+
+def profile_dir_for(index, base=None):
+    """Perfil persistente de la sesión index (la primera conserva el perfil de siempre)."""
+    base = base or os.path.join(os.getcwd(), PROFILE_BASENAME)
+    return base if index == 0 else f"{base}_{index + 1}"
+
+class SessionLost(Exception):
+    """El navegador de la sesión se cerró o dejó de responder."""
+
+def is_session_lost(exc):
+    if isinstance(exc, (InvalidSessionIdException, NoSuchWindowException)):
+        return True
+    msg = str(exc).lower()
+    return isinstance(exc, WebDriverException) and ("not reachable" in msg or "disconnected" in msg)
+
+class WhatsAppSession:
+    """Un Chrome con su propio perfil y su propia sesión de WhatsApp Web.
+
+    url permite apuntar a otra página con el mismo DOM (simulador_whatsapp.py).
+    """
+
+    def __init__(self, index, log, profile_base=None, headless=False, url=WHATSAPP_URL):
+        load_selenium()
+        self.index = index
+        self.name = f"S{index + 1}"
+        self.profile_dir = profile_dir_for(index, profile_base)
+        self.headless = headless
+        self.url = url.rstrip("/")
+        self.log = log
+        self.on_state = lambda p, estado, **fields: None  # lo reemplaza el diario de envíos
+        self.metrics = SendMetrics()  # el SendScheduler pone las del envío en curso
+        self.greeting_as_caption = False  # saludo como leyenda del PDF: un solo mensaje
+        self.navigation = "url"  # "app": abrir chats existentes desde el buscador, sin recargar
+        self._not_in_chats = set()
+        self._app_nav_hits = self._app_nav_misses = 0
+        self.selectors = selector_book()
+        self._selector_wins = {}  # elemento -> selector que acertó en esta sesión
+        self.lean = LEAN_PROFILE
+        self.block_images = BLOCK_IMAGES
+        self.pipeline = False  # abrir el siguiente chat apenas se confirma el PDF (prefetch_chat)
+        self._prefetched = None  # (número, fallo o None) del chat ya abierto por prefetch_chat
+        self.driver = None
+        self._launcher = None
+
+    def _start_driver(self):
+        options = webdriver.ChromeOptions()
+        options.add_argument(f"--user-data-dir={self.profile_dir}")
+        options.add_argument("window-size=1200,900")
+        options.add_argument("--disable-notifications")
+        if self.headless:
+            options.add_argument("--headless=new")
+        if self.lean:
+            freed = prune_profile(self.profile_dir)
+            if freed is None:
+                self.log("El perfil está abierto en otro Chrome; no se podan sus cachés.")
+            elif freed >= 1 << 20:
+                self.log(f"Perfil podado: {freed / 1048576:.0f} MB de cachés borrados.")
+            for arg in LEAN_CHROME_ARGS:
+                options.add_argument(arg)
+        if self.block_images:
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        self.driver = webdriver.Chrome(service=Service(resolve_chromedriver(self.log)), options=options)
+
+    def launch_async(self):
+        """Arranca Chrome y carga WhatsApp Web en segundo plano; open() espera a que termine."""
+        if self.driver is None and self._launcher is None:
+            self._launcher = threading.Thread(target=self._prelaunch, daemon=True)
+            self._launcher.start()
+
+    def _prelaunch(self):
+        try:
+            self._start_driver()
+            self.driver.get(self.url)
+        except Exception as e:
+            self.log(f"No se pudo preabrir el navegador: {e}")
+
+    def open(self):
+        if self._launcher is not None:
+            self._launcher.join()
+            self._launcher = None
+            if self.driver is not None:
+                return
+        if self.driver is None:
+            self._start_driver()
+        self.driver.get(self.url)
+
+    def wait_login(self, timeout=180):
+        try:
+            box, _ = self.wait_for("buscador", timeout, need="present")
+        except Exception:
+            box = None
+        if box is not None:
+            self.log("WhatsApp Web: sesión detectada.")
+            return True
+        self.log("No se detectó inicio de sesión en el tiempo esperado.")
+        return False
+
+    def wait_dom(self, condition, timeout, param=None):
+        """Espera a que se cumpla una condición de DOM_WAIT_JS y devuelve su valor; False si vence el tiempo."""
+        selectors = {role: self.selectors.candidates(role, self._selector_wins.get(role)) for role in DOM_WAIT_ROLES}
+        self.driver.set_script_timeout(timeout + 5)
+        try:
+            return self.driver.execute_async_script(DOM_WAIT_JS, condition, int(timeout * 1000), param,
+                                                    selectors) or False
+        except TimeoutException:
+            return False
+
+    def _resolve(self, role, need="visible"):
+        """Como find, sin métricas ni aprendizaje: para sondear dentro de una espera."""
+        return self.driver.execute_script(RESOLVE_JS, self.selectors.candidates(role, self._selector_wins.get(role)),
+                                          need)
+
+    def wait_for(self, role, timeout, need="visible"):
+        """Espera hasta timeout a que aparezca un elemento de role y lo devuelve como find."""
+        try:
+            WebDriverWait(self.driver, timeout).until(lambda d: self._resolve(role, need))
+        except TimeoutException:
+            self.metrics.count(f"selector_{role}", "ninguno")
+            return None, None
+        return self.find(role, need)
+
+    def find(self, role, need="visible"):
+        """Primer elemento de role que cumple need ("present", "visible" o "enabled").
+
+        Devuelve (elemento, selector) o (None, None) y cuenta el selector en las métricas.
+        """
+        xpaths = self.selectors.candidates(role, self._selector_wins.get(role))
+        found = self.driver.execute_script(RESOLVE_JS, xpaths, need)
+        if not found:
+            self.metrics.count(f"selector_{role}", "ninguno")
+            return None, None
+        xpath = xpaths[int(found[0])]
+        self.metrics.count(f"selector_{role}", xpath)
+        if self._selector_wins.get(role) != xpath:
+            self._selector_wins[role] = xpath
+            self.selectors.learn(role, xpath)
+        return found[1], xpath
+
+    def last_outgoing_id(self):
+        return self.driver.execute_script(LAST_OUTGOING_JS) or ""
+
+    def wait_confirmed(self, baseline):
+        """Espera a que el nuevo mensaje saliente deje de estar pendiente. Devuelve el ícono o ""."""
+        return self.wait_dom("outgoing_acked", STEP_TIMEOUTS["confirm"], baseline) or ""
+
+    def quit(self):
+        if self._launcher is not None:
+            self._launcher.join(timeout=30)
+        try:
+            if self.driver:
+                self.driver.quit()
+        except Exception:
+            pass
+        self.driver = None
+
+    def send_text_message(self, message_text):
+        """Envía un mensaje de texto usando múltiples métodos"""
+        try:
+            # Método 1: JavaScript directo (más confiable)
+            js_code = """
+            function sendMessage(text, textbox, buttonXpaths) {
+                if (!textbox) return false;
+                
+                // Limpiar y establecer el texto
+                textbox.innerHTML = '';
+                textbox.textContent = text;
+                
+                // Disparar eventos necesarios
+                const inputEvent = new InputEvent('input', { bubbles: true, inputType: 'insertText', data: text });
+                textbox.dispatchEvent(inputEvent);
+                
+                // Pequeña espera para que WhatsApp procese
+                setTimeout(() => {
+                    for (const xpath of buttonXpaths) {
+                        const sendBtn = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+                        if (sendBtn) {
+                            sendBtn.click();
+                            break;
+                        }
+                    }
+                }, 100);
+                
+                return true;
+            }
+            return sendMessage(arguments[0], arguments[1], arguments[2]);
+            """
+            textbox, _ = self.find("caja_texto")
+            result = textbox is not None and self.driver.execute_script(
+                js_code, message_text, textbox, self.selectors.candidates("enviar_texto", self._selector_wins.get("enviar_texto")))
+            if result and self.wait_dom("text_sent", STEP_TIMEOUTS["text"]):
+                self.metrics.count("saludo_metodo", "js")
+                return True
+            if result:
+                self.log("El mensaje no salió por JS, se intenta con el teclado...")
+        except Exception as e:
+            if is_session_lost(e):
+                raise
+            self.log(f"Error en método JS: {e}")
+        
+        # Método 2: Selenium tradicional con ActionChains
+        try:
+            textbox, _ = self.wait_for("caja_texto", STEP_TIMEOUTS["text"], need="enabled")
+            if textbox is None:
+                raise TimeoutException("no se encontró la caja de texto")
+            textbox.click()
+            
+            # Limpiar cualquier texto previo
+            textbox.clear()
+            
+            # Usar ActionChains para escribir
+            actions = ActionChains(self.driver)
+            actions.move_to_element(textbox)
+            actions.click()
+            actions.send_keys(message_text)
+            actions.send_keys(Keys.ENTER)
+            actions.perform()
+            
+            sent = self.wait_dom("text_sent", STEP_TIMEOUTS["text"])
+            self.metrics.count("saludo_metodo", "actionchains" if sent else "fallido")
+            return sent
+        except Exception as e:
+            if is_session_lost(e):
+                raise
+            self.log(f"Error en método ActionChains: {e}")
+        
+        self.metrics.count("saludo_metodo", "fallido")
+        return False
+
+    def open_chat_in_app(self, tel_digits):
+        """Abre un chat existente desde el buscador, sin recargar WhatsApp Web.
+
+        Solo lo da por abierto si el chat muestra mensajes de ese número (data-id); si no,
+        devuelve False y send_to usa /send. Tras APP_NAV_GIVE_UP fallos seguidos sin ningún
+        acierto la sesión deja de intentarlo.
+        """
+        if tel_digits in self._not_in_chats:
+            return False
+        found = False
+        try:
+            box, _ = self.find("buscador")
+            if box is None:
+                raise RuntimeError("no se encontró el buscador")
+            box.click()
+            box.send_keys(Keys.CONTROL, "a")
+            box.send_keys(Keys.BACKSPACE)
+            # Los 9 dígitos locales coinciden tanto con "+51 987 654 321" como con "987654321"
+            box.send_keys(tel_digits[-9:], Keys.ENTER)
+            found = bool(self.wait_dom("chat_for", STEP_TIMEOUTS["search"], tel_digits))
+        except Exception as e:
+            if is_session_lost(e):
+                raise
+            self.log(f"Búsqueda de chat fallida: {e}")
+        if found:
+            self._app_nav_hits += 1
+            self._app_nav_misses = 0
+        else:
+            self._not_in_chats.add(tel_digits)
+            self._app_nav_misses += 1
+            if not self._app_nav_hits and self._app_nav_misses >= APP_NAV_GIVE_UP:
+                self.navigation = "url"
+                self.log("El buscador no abrió ningún chat; se vuelve a abrir cada chat con /send.")
+        return found
+
+    def open_chat(self, tel_digits):
+        """Abre el chat de tel_digits en la pestaña actual (buscador o /send).
+
+        Devuelve None si quedó abierto, o el fallo: TIMEOUT_CHAT o NUMERO_INVALIDO.
+        """
+        try:
+            if self.navigation == "app" and self.open_chat_in_app(tel_digits):
+                self.metrics.count("navegacion", "buscador")
+            else:
+                self.metrics.count("navegacion", "url")
+                self.driver.get(f"{self.url}/send?phone={tel_digits}&app_absent=0")
+                # Esperar a que cargue el chat (o a que WhatsApp avise que el número no es válido)
+                WebDriverWait(self.driver, STEP_TIMEOUTS["chat"]).until(
+                    lambda d: self._resolve("caja_texto", "enabled") or d.find_elements(By.XPATH, INVALID_NUMBER_XPATH))
+        except TimeoutException:
+            return "TIMEOUT_CHAT"
+        if self.driver.find_elements(By.XPATH, INVALID_NUMBER_XPATH):
+            return "NUMERO_INVALIDO"
+        return None
+
+    def prefetch_chat(self, tel_digits):
+        """Abre ya el chat de tel_digits, en la misma pestaña, para el siguiente send_group.
+
+        No se superpone con la subida del PDF: WhatsApp Web admite una sola pestaña activa
+        por navegador (la otra queda en «Usar aquí») y dejar el chat antes de la marca de
+        enviado cortaría la subida, así que send_group la llama recién con el PDF confirmado.
+        Lo que se gana es que la carga ocurre antes de Pacer.wait y la cubeta se rellena
+        mientras tanto: ese tiempo se descuenta de la espera del ritmo. Solo acelera cuando
+        el ritmo es lo que limita (ritmo bajo, o tras una bajada por fallos); si no hay espera,
+        el chat tarda lo mismo en abrirse. Con navigation="app" se abre desde el buscador, sin
+        recargar la página. Un fallo aquí no afecta a nada: el siguiente chat se abre de la
+        forma habitual.
+        """
+        self._prefetched = None
+        try:
+            with self.metrics.timer("precarga"):
+                self._prefetched = (tel_digits, self.open_chat(tel_digits))
+        except Exception as e:
+            # El envío en curso ya quedó ENVIADO; si el navegador se cayó lo detecta el siguiente
+            self.log(f"No se pudo precargar el siguiente chat: {e}")
+
+    def fill_caption(self, text):
+        """Escribe text en la leyenda de la vista previa del adjunto. True si lo logró."""
+        try:
+            box, _ = self.find("leyenda")
+            if box is None:
+                return False
+            box.click()
+            ActionChains(self.driver).send_keys_to_element(box, text).perform()
+            return True
+        except Exception as e:
+            if is_session_lost(e):
+                raise
+            self.log(f"No se pudo escribir la leyenda: {e}")
+            return False
+
+    def send_pdf_attachment(self, pdf_paths, on_preview=None):
+        """Envía uno o varios PDFs (ruta o lista de rutas) en un mismo adjunto.
+
+        on_preview() se llama con la vista previa abierta, antes de enviar (para la leyenda).
+        Devuelve None si el PDF salió, o el fallo: ERROR_ADJUNTO (no se pudo adjuntar),
+        ERROR_BOTON_ENVIAR (el adjunto quedó en la vista previa sin enviarse) o SIN_CONFIRMAR
+        (un error, o la caída del navegador, después del clic en enviar: el PDF pudo salir).
+        """
+        metrics = self.metrics
+        clicked = False
+        try:
+            # Paso 1: Click en el botón de adjuntar
+            started = time.perf_counter()
+            attach_btn, _ = self.find("adjuntar")
+            if attach_btn is None:
+                self.log("No se encontró el botón de adjuntar")
+                return "ERROR_ADJUNTO"
+            
+            attach_btn.click()
+            if not self.wait_dom("file_input", STEP_TIMEOUTS["attach"]):
+                self.log("El menú de adjuntar no mostró el input de archivo")
+            metrics.observe("clic_adjuntar", time.perf_counter() - started)
+            
+            # Paso 2: Localizar el input de archivo (oculto: basta que exista) y subir
+            file_input, _ = self.find("input_archivo", need="present")
+            if file_input is None:
+                self.log("No se encontró el input de archivo")
+                return "ERROR_ADJUNTO"
+            
+            # Enviar las rutas (el input de WhatsApp admite varios archivos separados por \n)
+            started = time.perf_counter()
+            file_input.send_keys(pdf_paths if isinstance(pdf_paths, str) else "\n".join(pdf_paths))
+            self.log(f"Archivo adjuntado, esperando preview...")
+            if not self.wait_dom("preview_ready", STEP_TIMEOUTS["preview"]):
+                self.log("La vista previa del PDF no apareció a tiempo")
+            metrics.observe("vista_previa", time.perf_counter() - started)
+            if on_preview is not None:
+                on_preview()
+            
+            # Paso 3: La vista previa ya está lista: click en enviar
+            started = time.perf_counter()
+            send_btn, _ = self.find("enviar", need="enabled")
+            if send_btn is not None:
+                try:
+                    send_btn.click()
+                    clicked = True
+                except Exception as e:
+                    if is_session_lost(e):
+                        raise
+                if clicked:
+                    self.log("Click en botón enviar exitoso")
+                    closed = self.wait_dom("preview_closed", STEP_TIMEOUTS["upload"], send_btn)
+                    metrics.observe("subida", time.perf_counter() - started)
+                    return None if closed else "ERROR_BOTON_ENVIAR"
+            
+            # Si no funciona con clicks, intentar con JavaScript (visible aunque figure deshabilitado)
+            self.log("Intentando enviar con JavaScript...")
+            send_btn, _ = self.find("enviar")
+            result = send_btn is not None and self.driver.execute_script("arguments[0].click(); return true;", send_btn)
+            if result:
+                clicked = True
+                metrics.count("selector_enviar", "js")
+            closed = result and self.wait_dom("preview_closed", STEP_TIMEOUTS["upload"], send_btn)
+            metrics.observe("subida", time.perf_counter() - started)
+            if closed:
+                return None
+            
+            self.log("No se pudo hacer click en el botón de enviar")
+            return "ERROR_BOTON_ENVIAR"
+            
+        except Exception as e:
+            if clicked:
+                # Ya se hizo clic en enviar: reintentar podría duplicar el certificado
+                self.log(f"Error tras el clic en enviar: {e}")
+                return "SIN_CONFIRMAR"
+            if is_session_lost(e):
+                raise
+            self.log(f"Error enviando PDF: {e}")
+            return "ERROR_ADJUNTO"
+
+    def send_to(self, p):
+        """Envía saludo y certificado a un participante. Devuelve la fila de resultado."""
+        return self.send_group([p])[0]
+
+    def send_group(self, group, next_group=None):
+        """Envía saludo y certificados a participantes del mismo número en una sola visita al chat.
+
+        Todos los PDFs van en un único adjunto múltiple y el saludo se envía una vez.
+        Devuelve una fila de resultado por participante, en el orden de group. Los PDFs solo
+        cuentan como ENVIADO cuando la última burbuja muestra la marca de enviado (msg-check
+        o superior); si sigue con el reloj al vencer el plazo quedan SIN_CONFIRMAR.
+        Con pipeline, tras confirmarse el PDF se abre ya el chat de next_group, antes de la
+        espera del ritmo (prefetch_chat).
+        """
+        first = group[0]
+        name_display = first["display"] if len(group) == 1 else f"{first['display']} (+{len(group) - 1})"
+        num = first["NUM_WA"]
+        tel_digits = re.sub(r"\D", "", str(num))
+        inicio = time.strftime("%Y-%m-%d %H:%M:%S")
+        results = {id(p): {"NOMBRE": p["NOMBRES"], "TELEFONO": num, "ESTADO": "", "SALUDO": "",
+                           "CONFIRMACION": "", "INICIO": inicio, "FIN": ""} for p in group}
+        metrics = self.metrics
+        started = time.perf_counter()
+        pending = list(group)  # los que siguen en curso en esta visita
+
+        def set_all(field, value):
+            for p in pending:
+                results[id(p)][field] = value
+
+        def on_state(estado, **fields):
+            for p in pending:
+                self.on_state(p, estado, **fields)
+
+        def close(members, estado):
+            fin = time.strftime("%Y-%m-%d %H:%M:%S")
+            for p in members:
+                result = results[id(p)]
+                result["ESTADO"] = estado
+                result["FIN"] = fin
+                metrics.count("estado", estado if not estado.startswith("ERROR:") else "ERROR")
+                self.on_state(p, estado, **result)
+
+        def finish(estado):
+            close(pending, estado)
+            metrics.observe("destinatario", time.perf_counter() - started)
+            return [results[id(p)] for p in group]
+
+        missing = [p for p in group if not p["ENCONTRADO"] or not p["PDF_PATH"] or not os.path.exists(p["PDF_PATH"])]
+        if missing:
+            for p in missing:
+                self.log(f"❌ {p['display']}: PDF no encontrado.")
+            close(missing, "PDF_NO")
+            missing_ids = {id(p) for p in missing}
+            pending = [p for p in group if id(p) not in missing_ids]
+            if not pending:
+                return finish("PDF_NO")
+        if not wa_number_ok(tel_digits):
+            self.log(f"❌ {name_display}: número de WhatsApp inválido ({num or 'vacío'}).")
+            return finish("NUMERO_INVALIDO")
+
+        outcome = None  # tras el clic en enviar: estado final, que ningún error posterior cambia
+        try:
+            # Abrir chat
+            self.log(f"📱 Abriendo chat de {name_display}...")
+            on_state("ABRIENDO_CHAT", inicio=inicio)
+            prefetched, self._prefetched = self._prefetched, None
+            with metrics.timer("abrir_chat"):
+                if prefetched and prefetched[0] == tel_digits:
+                    # Abierto al terminar el envío anterior, mientras se esperaba el turno
+                    metrics.count("navegacion", "precargado")
+                    failure = prefetched[1]
+                else:
+                    failure = self.open_chat(tel_digits)
+            if failure == "TIMEOUT_CHAT":
+                self.log(f"❌ {name_display}: el chat no cargó en {STEP_TIMEOUTS['chat']} s.")
+                return finish("TIMEOUT_CHAT")
+            if failure == "NUMERO_INVALIDO":
+                self.log(f"❌ {name_display}: WhatsApp indica que {num} no es un número válido.")
+                return finish("NUMERO_INVALIDO")
+
+            # Un solo saludo por visita; si los textos difieren (nombres distintos) van juntos
+            texts = []
+            for p in pending:
+                text = p.get("SALUDO_TEXTO") or GreetingTemplate().render(p)
+                if text not in texts:
+                    texts.append(text)
+            message_text = " ".join(texts)
+            captioned = False
+
+            def add_caption():
+                nonlocal captioned
+                captioned = self.fill_caption(message_text)
+                if not captioned:
+                    self.log("No se encontró el campo de leyenda; el saludo irá como mensaje aparte.")
+
+            def send_greeting(record=True):
+                self.log(f"💬 Enviando mensaje a {name_display}...")
+                baseline = self.last_outgoing_id()
+                with metrics.timer("saludo"):
+                    greeted = self.send_text_message(message_text)
+                if greeted:
+                    with metrics.timer("confirmar_saludo"):
+                        saludo = "CONFIRMADO" if self.wait_confirmed(baseline) else "SIN_CONFIRMAR"
+                    set_all("SALUDO", saludo)
+                    self.log(f"✅ Mensaje enviado a {name_display} ({saludo.lower()})")
+                    if record:
+                        on_state("SALUDO_ENVIADO", saludo=saludo)
+                else:
+                    set_all("SALUDO", "NO_ENVIADO")
+                    self.log(f"⚠️ No se pudo enviar el mensaje a {name_display}")
+
+            # Saludo como mensaje aparte, salvo que vaya como leyenda del PDF
+            if not self.greeting_as_caption:
+                send_greeting()
+
+            # Enviar los PDFs en un solo adjunto
+            paths = [p.get("PDF_ENVIO") or p["PDF_PATH"] for p in pending]
+            self.log(f"📎 Adjuntando {len(paths)} PDF para {name_display}..." if len(paths) > 1
+                     else f"📎 Adjuntando PDF para {name_display}...")
+            baseline = self.last_outgoing_id()
+            on_state("ADJUNTANDO_PDF", saludo=results[id(pending[0])]["SALUDO"])
+            failure = self.send_pdf_attachment(paths, on_preview=add_caption if self.greeting_as_caption else None)
+            if failure == "SIN_CONFIRMAR":
+                self.log(f"⚠️ El PDF para {name_display} pudo haber salido; queda sin confirmar")
+                return finish(failure)
+            if failure:
+                self.log(f"❌ Error al enviar PDF a {name_display}")
+                return finish(failure)
+            outcome = "SIN_CONFIRMAR"
+            on_state("PDF_EN_CAMINO")
+            with metrics.timer("confirmar_pdf"):
+                set_all("CONFIRMACION", self.wait_confirmed(baseline))
+            if results[id(pending[0])]["CONFIRMACION"]:
+                outcome = "ENVIADO"
+            if self.greeting_as_caption:
+                if captioned:
+                    set_all("SALUDO", "EN_LEYENDA")
+                else:
+                    # El diario sigue en PDF_EN_CAMINO hasta cerrar: un corte aquí no reenvía
+                    send_greeting(record=False)
+            if outcome == "ENVIADO":
+                self.log(f"✅ PDF enviado exitosamente a {name_display}")
+                sent = finish("ENVIADO")
+                # Con la marca de enviado ya se puede dejar este chat (sin ella no: la subida se cortaría)
+                if self.pipeline and next_group is not None:
+                    next_tel = re.sub(r"\D", "", str(next_group[0]["NUM_WA"]))
+                    if next_tel != tel_digits and wa_number_ok(next_tel) and any(p["ENCONTRADO"] for p in next_group):
+                        self.prefetch_chat(next_tel)
+                return sent
+            self.log(f"⚠️ El PDF para {name_display} sigue pendiente (sin marca de enviado)")
+            return finish("SIN_CONFIRMAR")
+
+        except Exception as e:
+            if outcome:
+                # El PDF ya salió de la vista previa: reintentar lo duplicaría. Si el navegador
+                # se cayó, el siguiente envío de esta sesión lo detecta.
+                self.log(f"⚠️ Error con {name_display} después de enviar el PDF ({e}); queda {outcome}.")
+                return finish(outcome)
+            if is_session_lost(e):
+                raise SessionLost(str(e)) from e
+            self.log(f"❌ Error con {name_display}: {e}")
+            return finish(f"ERROR: {str(e)[:50]}")
+
+# Ritmo de envío por sesión (ver Pacer). Se puede ajustar desde la línea de comandos.
+PACING = {
+    "rate": 20.0,            # mensajes por minuto al empezar
+    "min_rate": 2.0,         # piso al que puede bajar tras fallos
+    "max_rate": 30.0,        # techo al que puede volver a subir
+    "burst": 1,              # envíos seguidos permitidos sin esperar
+    "hourly_quota": 400,     # máximo de envíos por hora y por sesión
+    "jitter": 0.3,           # ±30 % de variación aleatoria en cada espera
+    "backoff": 0.5,          # factor al bajar el ritmo
+    "recovery": 1.2,         # factor al recuperar el ritmo
+    "recover_after": 5,      # éxitos seguidos para subir el ritmo
+    "failure_window": 10,    # últimos resultados considerados
+    "failure_threshold": 0.3,  # proporción de fallos que provoca bajar el ritmo
+}
+
+# Ajustes del ritmo que se pueden cambiar desde la ventana y la línea de comandos
+PACING_SETTINGS = {
+    "rate": "Mensajes por minuto al empezar",
+    "min_rate": "Ritmo mínimo (mensajes/min)",
+    "max_rate": "Ritmo máximo (mensajes/min)",
+    "hourly_quota": "Máximo de envíos por hora y por sesión",
+    "jitter": "Variación aleatoria de cada espera (0 a 0.9)",
+    "backoff": "Factor al bajar el ritmo tras fallos (0 a 1)",
+    "recovery": "Factor al recuperar el ritmo (1 o más)",
+    "recover_after": "Éxitos seguidos para recuperar el ritmo",
+}
+
+def check_pacing(config):
+    """Completa config con PACING y la valida; ValueError con el motivo si algo no tiene sentido."""
+    cfg = dict(PACING, **(config or {}))
+    if min(cfg["rate"], cfg["min_rate"], cfg["max_rate"]) <= 0:
+        raise ValueError("Los ritmos deben ser mayores que cero.")
+    if cfg["min_rate"] > cfg["max_rate"]:
+        raise ValueError("El ritmo mínimo no puede superar al máximo.")
+    if cfg["hourly_quota"] < 1 or cfg["recover_after"] < 1:
+        raise ValueError("La cuota por hora y los éxitos para recuperar deben ser al menos 1.")
+    if not 0 <= cfg["jitter"] < 1:
+        raise ValueError("La variación aleatoria debe estar entre 0 y 0.9.")
+    if not 0 < cfg["backoff"] <= 1 or cfg["recovery"] < 1:
+        raise ValueError("El factor de bajada va de 0 a 1 y el de recuperación debe ser 1 o más.")
+    return cfg
+
+class Pacer:
+    """Cubeta de fichas con cuota horaria, variación aleatoria y ritmo adaptativo.
+
+    Baja el ritmo ante un vencimiento al cargar un chat o cuando los fallos recientes
+    superan failure_threshold, y lo sube de a poco mientras los envíos salen bien.
+    """
+
+    def __init__(self, config=None):
+        self.cfg = dict(PACING, **(config or {}))
+        self.cfg["max_rate"] = max(self.cfg["max_rate"], self.cfg["rate"])
+        self.rate = max(float(self.cfg["rate"]), self.cfg["min_rate"])
+        self.tokens = float(self.cfg["burst"])
+        self.updated = time.monotonic()
+        self.sent_times = deque()
+        self.recent = deque(maxlen=self.cfg["failure_window"])
+        self.successes = 0
+        self.interval = None   # promedio móvil del tiempo real entre envíos
+        self.last_start = None
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        cap = float(self.cfg["burst"])
+        self.tokens = min(cap, self.tokens + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def _delay(self, now):
+        self._refill(now)
+        delay = 0.0 if self.tokens >= 1 else (1 - self.tokens) * 60.0 / self.rate
+        while self.sent_times and now - self.sent_times[0] >= 3600:
+            self.sent_times.popleft()
+        if len(self.sent_times) >= self.cfg["hourly_quota"]:
+            delay = max(delay, 3600 - (now - self.sent_times[0]))
+        return delay
+
+    def wait(self, should_stop):
+        """Bloquea hasta que corresponda el próximo envío. False si se pidió detener.
+
+        La variación aleatoria puede adelantar o atrasar la espera del ritmo, pero la de la
+        cuota horaria solo la alarga, y la cuota se vuelve a comprobar antes de enviar.
+        """
+        slept = False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                delay = self._delay(now)
+                over_quota = len(self.sent_times) >= self.cfg["hourly_quota"]
+                if delay <= 0 or (slept and not over_quota):
+                    self._refill(now)
+                    self.tokens = max(0.0, self.tokens - 1)
+                    self.sent_times.append(now)
+                    if self.last_start is not None:
+                        gap = now - self.last_start
+                        self.interval = gap if self.interval is None else 0.8 * self.interval + 0.2 * gap
+                    self.last_start = now
+                    return not should_stop()
+            jitter = self.cfg["jitter"]
+            delay *= random.uniform(1, 1 + jitter) if over_quota else random.uniform(1 - jitter, 1 + jitter)
+            end = time.monotonic() + delay
+            while time.monotonic() < end:
+                if should_stop():
+                    return False
+                time.sleep(min(0.2, end - time.monotonic()))
+            slept = True
+
+    def report(self, ok, timeout=False):
+        """Ajusta el ritmo según el resultado del último envío."""
+        with self.lock:
+            self.recent.append(ok)
+            failures = self.recent.count(False) / len(self.recent)
+            if timeout or (not ok and failures >= self.cfg["failure_threshold"]):
+                self.rate = max(self.cfg["min_rate"], self.rate * self.cfg["backoff"])
+                self.successes = 0
+            elif ok:
+                self.successes += 1
+                if self.successes >= self.cfg["recover_after"]:
+                    self.rate = min(self.cfg["max_rate"], self.rate * self.cfg["recovery"])
+                    self.successes = 0
+
+    def throughput(self):
+        """Envíos por minuto que está logrando la sesión (el ritmo configurado si aún no hay datos)."""
+        if self.interval:
+            return min(self.rate, 60.0 / self.interval)
+        return self.rate
+
+def format_eta(seconds):
+    """'1 h 05 min' / '12 min' / '40 s' para mostrar el tiempo restante."""
+    if seconds is None:
+        return "calculando..."
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+    if seconds >= 60:
+        return f"{math.ceil(seconds / 60)} min"
+    return f"{seconds} s"
+
+class SendScheduler:
+    """Reparte los destinatarios entre las sesiones abiertas y combina sus resultados.
+
+    La unidad de trabajo es un grupo de participantes con el mismo número (plan_recipients):
+    una visita al chat. Todas las sesiones toman grupos de una misma cola, así que una
+    sesión lenta no retrasa a las demás; cada una lleva su propio Pacer. Si una sesión se
+    cae (o acumula MAX_SESSION_FAILURES fallos seguidos mientras otras siguen activas)
+    devuelve a la cola lo que tenía pendiente.
+
+    Los fallos transitorios (is_transient_failure) pasan a una cola de reintentos con
+    espera exponencial, hasta MAX_ATTEMPTS intentos por grupo.
+
+    Con pipeline, cada sesión toma el grupo siguiente antes de terminar el actual para abrir
+    su chat apenas se confirma el PDF; esa carga se descuenta de la espera del Pacer
+    (WhatsAppSession.prefetch_chat).
+
+    on_progress(hechos, total, eta) cuenta participantes y recibe la estimación de segundos
+    restantes (o None).
+    """
+
+    def __init__(self, sessions, log, on_progress, should_stop, pacing=None, journal=None, metrics=None,
+                 caption=False, navigation="url", pipeline=False):
+        self.sessions = sessions
+        self.journal = journal
+        if journal is not None:
+            for s in sessions:
+                s.on_state = journal.record
+        self.metrics = metrics or SendMetrics()
+        for s in sessions:
+            s.metrics = self.metrics
+            s.greeting_as_caption = caption
+            s.navigation = navigation
+            s.pipeline = pipeline
+        self.log = log
+        self.on_progress = on_progress
+        self.should_stop = should_stop
+        self.pacers = {s.name: Pacer(pacing) for s in sessions}
+        self.lock = threading.Lock()
+
+    def run(self, groups):
+        """Envía a todos los grupos. Devuelve (enviados, no_enviados)."""
+        self.pending = queue.Queue()
+        for group in groups:
+            self.pending.put(group)
+        self.retries = []  # montículo de (momento, orden, grupo)
+        self.attempts = Counter()  # por id del primer participante del grupo
+        self.retry_seq = itertools.count()
+        self.total = sum(len(g) for g in groups)
+        self.visits_per_recipient = len(groups) / self.total if self.total else 1.0
+        self.done = 0
+        self.active = len(self.sessions)
+        self.sent, self.not_sent = [], []
+        self.on_progress(0, self.total, self.eta())
+
+        workers = [threading.Thread(target=self._worker, args=(s,), daemon=True) for s in self.sessions]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        if not self.should_stop():
+            # Se cayeron todas las sesiones: lo que quedó en cola se reporta como no enviado
+            leftover = [g for _, _, g in self.retries]
+            while not self.pending.empty():
+                leftover.append(self.pending.get_nowait())
+            for p in itertools.chain.from_iterable(leftover):
+                self.not_sent.append({"NOMBRE": p["NOMBRES"], "TELEFONO": p["NUM_WA"], "ESTADO": "SIN_SESION"})
+                if self.journal is not None:
+                    self.journal.record(p, "SIN_SESION")
+        return self.sent, self.not_sent
+
+    def rate(self):
+        """Visitas a chats por minuto que suman las sesiones activas."""
+        return sum(self.pacers[s.name].throughput() for s in self.sessions)
+
+    def eta(self):
+        """Segundos estimados para terminar la cola, según el ritmo actual."""
+        rate = self.rate()
+        remaining = (self.total - self.done) * self.visits_per_recipient
+        return remaining * 60.0 / rate if rate > 0 else None
+
+    def _record(self, results):
+        with self.lock:
+            for result in results:
+                (self.sent if result["ESTADO"] == "ENVIADO" else self.not_sent).append(result)
+            self.done += len(results)
+            self.on_progress(self.done, self.total, self.eta())
+
+    def _retry_later(self, group, estado):
+        """Programa otro intento si el fallo es transitorio y quedan intentos. True si se programó."""
+        with self.lock:
+            self.attempts[id(group[0])] += 1
+            attempt = self.attempts[id(group[0])]
+            if not is_transient_failure(estado) or attempt >= MAX_ATTEMPTS:
+                return False
+            delay = RETRY_BASE_DELAY * 2 ** (attempt - 1)
+            heapq.heappush(self.retries, (time.monotonic() + delay, next(self.retry_seq), group))
+        self.log(f"🔁 {group[0]['display']}: {estado}; reintento {attempt + 1}/{MAX_ATTEMPTS} en {delay} s.")
+        return True
+
+    def _next(self):
+        """Siguiente grupo: primero la cola, luego los reintentos ya vencidos.
+
+        Si solo quedan reintentos por vencer, espera (atento a should_stop). None si no hay más trabajo.
+        """
+        while not self.should_stop():
+            try:
+                return self.pending.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                if not self.retries:
+                    return None
+                wait = self.retries[0][0] - time.monotonic()
+                if wait <= 0:
+                    return heapq.heappop(self.retries)[2]
+            time.sleep(min(0.2, wait))
+        return None
+
+    def _take_now(self):
+        """Siguiente grupo de la cola, sin esperar; None si está vacía o se pidió detener."""
+        if self.should_stop():
+            return None
+        try:
+            return self.pending.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _retire(self, session, requeue, reason):
+        with self.lock:
+            self.active -= 1
+            for group, results in requeue:
+                if results is not None:
+                    for result in results:
+                        self.not_sent.remove(result)
+                    self.attempts[id(group[0])] -= 1  # el fallo fue de la sesión, no cuenta como intento
+                    self.done -= len(results)
+                if self.journal is not None:
+                    for p in group:
+                        self.journal.record(p, "PENDIENTE")
+                self.pending.put(group)
+        n = sum(len(group) for group, _ in requeue)
+        self.log(f"⚠️ Sesión {session.name} fuera de servicio ({reason}); {n} destinatarios vuelven a la cola.")
+
+    def _worker(self, session):
+        pacer = self.pacers[session.name]
+        failures = 0  # fallos seguidos de esta sesión
+        streak = []   # (grupo, resultados) de esos fallos que no quedaron para reintento
+        upcoming = None  # grupo ya tomado de la cola cuyo chat se precarga
+        while True:
+            group, upcoming = (upcoming, None) if upcoming is not None else (self._next(), None)
+            if group is None:
+                with self.lock:
+                    self.active -= 1  # ya no toma trabajo: no cuenta para retirar a otras
+                return
+            if any(p["ENCONTRADO"] for p in group):
+                with self.metrics.timer("espera_ritmo"):
+                    go_on = pacer.wait(self.should_stop)
+                if not go_on:
+                    self.pending.put(group)
+                    return
+            if session.pipeline:
+                upcoming = self._take_now()
+            held = [(upcoming, None)] if upcoming is not None else []
+            try:
+                results = session.send_group(group, next_group=upcoming)
+            except SessionLost as e:
+                self._retire(session, streak + [(group, None)] + held,
+                             str(e).splitlines()[0] if str(e) else "navegador cerrado")
+                return
+            # Los fallos definitivos (PDF faltante, número inválido) no dependen de la sesión:
+            # se registran ya, sin ajustar el ritmo ni contar como racha
+            done = [r for r in results if r["ESTADO"] in PERMANENT_FAILURES]
+            if done:
+                self._record(done)
+            live = [(p, r) for p, r in zip(group, results) if r["ESTADO"] not in PERMANENT_FAILURES]
+            if not live:
+                continue
+            group = [p for p, _ in live]
+            results = [r for _, r in live]
+            estado = results[0]["ESTADO"]
+            before = pacer.rate
+            pacer.report(estado == "ENVIADO", timeout=estado == "TIMEOUT_CHAT")
+            if pacer.rate != before:
+                self.log(f"⏱️ Ritmo de {session.name}: {pacer.rate:.1f} mensajes/min")
+            if estado == "ENVIADO":
+                self._record(results)
+                failures, streak = 0, []
+                continue
+            failures += 1
+            if not self._retry_later(group, estado):
+                self._record(results)
+                if estado not in IN_DOUBT_STATES:  # lo que pudo llegar no vuelve a la cola
+                    streak.append((group, results))
+            with self.lock:
+                others = self.active > 1
+            if failures >= MAX_SESSION_FAILURES and others:
+                self._retire(session, streak + held, f"{failures} fallos seguidos")
+                return
+
+# ---------------------------
+# Diario de envíos
+# ---------------------------
+
+JOURNAL_PATH = os.path.join(DATA_DIR, "diario_envios.sqlite")
+REPORT_COLUMNS = ["NOMBRE", "TELEFONO", "ESTADO", "SALUDO", "CONFIRMACION", "INICIO", "FIN", "PDF"]
+
+_pdf_hash_cache = {}
+
+def pdf_hash(path):
+    """SHA-256 del contenido del PDF, memoizado por (ruta, tamaño, mtime)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    key = (path, st.st_size, st.st_mtime_ns)
+    digest = _pdf_hash_cache.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _pdf_hash_cache[key] = h.hexdigest()
+    return digest
+
+class SendJournal:
+    """Diario de envíos en SQLite (modo WAL), una fila por (teléfono, hash del PDF).
+
+    Cada cambio de estado se agrega a `eventos` y actualiza el último estado en
+    `envios`; tras un cierre inesperado el diario dice quién ya recibió su certificado.
+    """
+
+    FIELDS = ("nombre", "pdf", "saludo", "confirmacion", "inicio", "fin")
+
+    def __init__(self, path=JOURNAL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS envios (
+            telefono TEXT NOT NULL, pdf_hash TEXT NOT NULL, estado TEXT NOT NULL,
+            nombre TEXT, pdf TEXT, saludo TEXT, confirmacion TEXT, inicio TEXT, fin TEXT,
+            actualizado TEXT NOT NULL, PRIMARY KEY (telefono, pdf_hash))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, telefono TEXT NOT NULL, pdf_hash TEXT NOT NULL,
+            estado TEXT NOT NULL, momento TEXT NOT NULL)""")
+
+    @staticmethod
+    def key(p):
+        if "PDF_HASH" not in p:
+            p["PDF_HASH"] = pdf_hash(p["PDF_PATH"]) if p["PDF_PATH"] else ""
+        return str(p["NUM_WA"]), p["PDF_HASH"]
+
+    def record(self, p, estado, **fields):
+        """Registra un cambio de estado del envío a p (campos opcionales en minúsculas o como en el reporte)."""
+        tel, digest = self.key(p)
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        values = {f: fields.get(f, fields.get(f.upper())) for f in self.FIELDS}
+        values["nombre"] = values["nombre"] or str(p.get("NOMBRES", ""))
+        values["pdf"] = values["pdf"] or os.path.basename(p.get("PDF_PATH", ""))
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.execute("INSERT INTO eventos (telefono, pdf_hash, estado, momento) VALUES (?, ?, ?, ?)",
+                            (tel, digest, estado, now))
+            self.db.execute(f"""INSERT INTO envios (telefono, pdf_hash, estado, actualizado, {", ".join(self.FIELDS)})
+                VALUES (?, ?, ?, ?, {", ".join("?" * len(self.FIELDS))})
+                ON CONFLICT (telefono, pdf_hash) DO UPDATE SET estado = excluded.estado,
+                actualizado = excluded.actualizado,
+                {", ".join(f"{f} = COALESCE(NULLIF(excluded.{f}, ''), envios.{f})" for f in self.FIELDS)}""",
+                            (tel, digest, estado, now, *[values[f] for f in self.FIELDS]))
+            self.db.execute("COMMIT")
+
+    def state(self, p):
+        with self.lock:
+            row = self.db.execute("SELECT estado FROM envios WHERE telefono = ? AND pdf_hash = ?", self.key(p)).fetchone()
+        return row[0] if row else None
+
+    def in_doubt(self, participants):
+        """Participantes cuyo último estado está en IN_DOUBT_STATES (el PDF pudo haber llegado)."""
+        return [p for p in participants if self.state(p) in IN_DOUBT_STATES]
+
+    def report(self, participants):
+        """Filas (enviados, no_enviados) del reporte para estos participantes, según el diario."""
+        sent, not_sent = [], []
+        for p in participants:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT nombre, telefono, estado, saludo, confirmacion, inicio, fin, pdf FROM envios "
+                    "WHERE telefono = ? AND pdf_hash = ?", self.key(p)).fetchone()
+            if row is None:
+                continue
+            rec = dict(zip(REPORT_COLUMNS, ("" if v is None else v for v in row)))
+            (sent if rec["ESTADO"] == "ENVIADO" else not_sent).append(rec)
+        return sent, not_sent
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+# ---------------------------
+# Revisión previa de PDFs
+# ---------------------------
+
+PDF_PREFLIGHT_CACHE = os.path.join(DATA_DIR, "revision_pdfs.json")
+PDF_OPTIMIZED_DIR = os.path.join(DATA_DIR, "pdf_optimizados")
+PDF_MAX_MB = 100             # WhatsApp no acepta documentos más grandes: PDF_GRANDE
+PDF_COMPRESS_ABOVE_MB = 5    # con compresión, copia liviana de los PDFs que superan este tamaño
+PREFLIGHT_MAX_WORKERS = 8
+PREFLIGHT_VERSION = 2        # subirlo invalida los resultados guardados
+# Estados de la revisión con los que el PDF se envía. SIN_REVISAR: sin pypdf solo se miran
+# la cabecera y el cierre, no que el PDF abra.
+PREFLIGHT_SENDABLE = {"OK", "SIN_REVISAR"}
+
+def _preflight_one(path, compress):
+    """Revisa un PDF (corre en un proceso aparte). Devuelve el resultado para el caché.
+
+    El tamaño se toma de os.stat y el hash se calcula por bloques: solo pypdf lee el PDF
+    entero, y solo si no supera PDF_MAX_MB.
+    """
+    try:
+        size = os.stat(path).st_size
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            head = f.read(1024)
+            h.update(head)
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+            f.seek(max(0, size - 2048))
+            tail = f.read(2048)
+    except OSError as e:
+        return {"hash": "", "tamano": 0, "paginas": None, "estado": "PDF_NO", "detalle": str(e), "copia": ""}
+    result = {"hash": h.hexdigest(), "tamano": size, "paginas": None,
+              "estado": "OK", "detalle": "", "copia": ""}
+    if size > PDF_MAX_MB * 1024 * 1024:
+        result.update(estado="PDF_GRANDE", detalle=f"{size / 1048576:.0f} MB (máximo {PDF_MAX_MB} MB)")
+        return result
+    if b"%PDF-" not in head:
+        result.update(estado="PDF_CORRUPTO", detalle="no tiene cabecera %PDF")
+        return result
+    if b"%%EOF" not in tail:
+        result.update(estado="PDF_CORRUPTO", detalle="truncado, sin %%EOF")
+        return result
+    if pypdf is None:
+        result.update(estado="SIN_REVISAR", detalle="pypdf no está instalado")
+        return result
+    try:
+        with open(path, "rb") as f:
+            reader = pypdf.PdfReader(f)
+            # Cifrado solo con contraseña de propietario: se abre igual; con contraseña de usuario, no
+            if reader.is_encrypted and not reader.decrypt(""):
+                result.update(estado="PDF_CIFRADO", detalle="pide contraseña para abrirse")
+                return result
+            result["paginas"] = len(reader.pages)
+            if compress and size > PDF_COMPRESS_ABOVE_MB * 1024 * 1024:
+                result["comprimido"] = True  # intentado, aunque no se guarde copia por no ahorrar
+                writer = pypdf.PdfWriter(clone_from=reader)
+                for page in writer.pages:
+                    page.compress_content_streams()
+                if hasattr(writer, "compress_identical_objects"):
+                    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+                out = io.BytesIO()
+                writer.write(out)
+                if out.tell() < size * 0.9:
+                    # Misma carpeta por hash y mismo nombre: quien lo recibe ve el nombre original
+                    folder = os.path.join(PDF_OPTIMIZED_DIR, result["hash"][:16])
+                    os.makedirs(folder, exist_ok=True)
+                    result["copia"] = os.path.join(folder, os.path.basename(path))
+                    with open(result["copia"], "wb") as copy:
+                        copy.write(out.getvalue())
+    except Exception as e:
+        result.update(estado="PDF_CORRUPTO", detalle=str(e)[:200])
+    return result
+
+class PdfPreflight:
+    """Revisión previa de los PDFs: que abran, páginas, tamaño, hash y copia comprimida opcional.
+
+    Corre en un pool de procesos antes del envío, así un PDF dañado no se descubre cuando
+    la vista previa de WhatsApp no aparece. Los resultados se guardan por hash y la ruta
+    recuerda (tamaño, mtime, hash): un archivo sin cambios no se vuelve a leer.
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or PDF_PREFLIGHT_CACHE
+        self.by_hash, self.paths = {}, {}
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == PREFLIGHT_VERSION:
+                self.by_hash, self.paths = data["archivos"], data["rutas"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": PREFLIGHT_VERSION, "archivos": self.by_hash, "rutas": self.paths}, f)
+        os.replace(tmp, self.cache_path)
+
+    def _cached(self, path, st, compress):
+        size, mtime, digest = self.paths.get(os.path.abspath(path)) or (None, None, None)
+        result = self.by_hash.get(digest) if (size, mtime) == (st.st_size, st.st_mtime_ns) else None
+        if result is None or (result["copia"] and not os.path.exists(result["copia"])):
+            return None
+        if result["estado"] == "SIN_REVISAR" and pypdf is not None:
+            return None  # revisado antes sin pypdf
+        if compress and pypdf is not None and result["estado"] == "OK" and not result.get("comprimido") \
+                and result["tamano"] > PDF_COMPRESS_ABOVE_MB * 1024 * 1024:
+            return None  # revisado antes sin compresión
+        return result
+
+    def run(self, paths, compress=False, log=None, workers=None):
+        """Revisa los PDFs y devuelve {ruta: resultado}; las rutas que no existen no figuran."""
+        log = log or (lambda msg: None)
+        results, stats, todo = {}, {}, []
+        for path in dict.fromkeys(paths):
+            try:
+                stats[path] = st = os.stat(path)
+            except OSError:
+                continue
+            cached = self._cached(path, st, compress)
+            if cached is not None:
+                results[path] = cached
+            else:
+                todo.append(path)
+        if todo:
+            started = time.perf_counter()
+            workers = min(workers or os.cpu_count() or 1, PREFLIGHT_MAX_WORKERS, len(todo))
+            checked = None
+            if workers > 1:
+                try:
+                    with ProcessPoolExecutor(max_workers=workers) as pool:
+                        checked = list(pool.map(_preflight_one, todo, [compress] * len(todo),
+                                                chunksize=max(1, len(todo) // (workers * 4))))
+                except Exception as e:  # sin procesos disponibles: se revisa en este mismo proceso
+                    log(f"La revisión en paralelo falló ({e}); se revisa uno por uno.")
+            if checked is None:
+                checked = [_preflight_one(path, compress) for path in todo]
+            for path, result in zip(todo, checked):
+                results[path] = result
+                if result["hash"]:
+                    st = stats[path]
+                    self.by_hash[result["hash"]] = result
+                    self.paths[os.path.abspath(path)] = [st.st_size, st.st_mtime_ns, result["hash"]]
+            self.save()
+            log(f"🔎 {len(todo)} PDFs revisados en {time.perf_counter() - started:.1f} s "
+                f"({len(results) - len(todo)} ya revisados antes).")
+        # El diario identifica cada envío por este mismo hash: así no vuelve a leer los PDFs
+        for path, result in results.items():
+            if result["hash"]:
+                st = stats[path]
+                _pdf_hash_cache[(path, st.st_size, st.st_mtime_ns)] = result["hash"]
+        return results
+
+def preflight_summary(results, limit=20):
+    """Líneas de registro con los PDFs que no se pueden enviar y las copias comprimidas."""
+    bad = [(path, r) for path, r in results.items() if r["estado"] not in PREFLIGHT_SENDABLE]
+    copies = [r for r in results.values() if r["copia"]]
+    unchecked = sum(r["estado"] == "SIN_REVISAR" for r in results.values())
+    lines = []
+    if unchecked:
+        lines.append(f"ℹ️ pypdf no está instalado: {unchecked} PDFs sin revisar (solo cabecera y cierre) "
+                     "y no se comprimen copias.")
+    for path, r in bad[:limit]:
+        lines.append(f"⚠️ {r['estado']}: {os.path.basename(path)} ({r['detalle']})")
+    if len(bad) > limit:
+        lines.append(f"... y {len(bad) - limit} PDFs más con problemas.")
+    if copies:
+        saved = sum(r["tamano"] - os.path.getsize(r["copia"]) for r in copies if os.path.exists(r["copia"]))
+        lines.append(f"🗜️ {len(copies)} PDFs se enviarán comprimidos ({saved / 1048576:.1f} MB menos).")
+    return lines
+
+# ---------------------------
+# Métricas de envío
+# ---------------------------
+
+METRIC_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)  # límites (s) de los histogramas
+PROMETHEUS_PREFIX = "whatsapp_envio"
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class SendMetrics:
+    """Latencia de cada paso del envío y contadores de qué método o selector funcionó.
+
+    Pasos: espera_ritmo, abrir_chat, saludo, confirmar_saludo, clic_adjuntar, vista_previa,
+    subida, confirmar_pdf y destinatario (todo send_to). Contadores: saludo_metodo (js,
+    actionchains), selector_<elemento> de SELECTORS_FILE (adjuntar, input_archivo, enviar o js,
+    leyenda) y estado.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}          # paso -> [segundos]
+        self.counters = Counter()  # (contador, valor) -> veces
+
+    @contextlib.contextmanager
+    def timer(self, step):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(step, time.perf_counter() - started)
 
-def candidate_is_phone_col(series: pd.Series) -> bool:
-    cnt = 0
-    checked = 0
-    for v in series.dropna().head(40):
-        checked += 1
-        s = re.sub(r"\D", "", str(v))
-        if 6 <= len(s) <= 13:
-            cnt += 1
-    if checked == 0:
-        return False
-    return (cnt / checked) >= 0.5
+    def observe(self, step, seconds):
+        with self.lock:
+            self.samples.setdefault(step, []).append(seconds)
 
-def format_peru_phone(raw: str) -> str:
-    tel = re.sub(r"\D", "", str(raw))
-    if tel.startswith("51") and len(tel) == 11:
-        return tel
-    if len(tel) == 9:
-        return "51" + tel
-    if len(tel) == 8:
-        return "51" + tel
-    return tel
+    def count(self, counter, value):
+        with self.lock:
+            self.counters[(counter, str(value))] += 1
 
-def extract_firstname_lastname_from_pdf(filename: str):
-    base = os.path.splitext(os.path.basename(filename))[0]
-    norm = normalize_text(base)
-    parts = [p for p in norm.split(" ") if p]
-    if len(parts) >= 2:
-        return parts[0], parts[1]
-    elif len(parts) == 1:
-        return parts[0], ""
-    else:
-        return "", ""
+    def summary(self):
+        """{"pasos": {paso: n, total, p50, p95, max, buckets}, "contadores": {contador: {valor: veces}}}."""
+        with self.lock:
+            samples = {step: sorted(v) for step, v in self.samples.items()}
+            counters = dict(self.counters)
+        steps = {}
+        for step, values in samples.items():
+            steps[step] = {
+                "n": len(values), "total": round(sum(values), 3), "p50": round(_percentile(values, 0.5), 3),
+                "p95": round(_percentile(values, 0.95), 3), "max": round(values[-1], 3),
+                # Acumulados, como los histogramas de Prometheus
+                "buckets": {str(b): sum(1 for v in values if v <= b) for b in METRIC_BUCKETS},
+            }
+        grouped = {}
+        for (counter, value), n in sorted(counters.items()):
+            grouped.setdefault(counter, {})[value] = n
+        return {"pasos": steps, "contadores": grouped}
+
+    def write(self, out_dir, stamp=None):
+        """Guarda METRICAS_<fecha>.json y .csv en out_dir. Devuelve las dos rutas."""
+        stamp = stamp or time.strftime("%Y%m%d_%H%M%S")
+        summary = self.summary()
+        json_path = os.path.join(out_dir, f"METRICAS_{stamp}.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        csv_path = os.path.join(out_dir, f"METRICAS_{stamp}.csv")
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["tipo", "nombre", "valor", "n", "total_s", "p50_s", "p95_s", "max_s"])
+            for step, s in summary["pasos"].items():
+                w.writerow(["paso", step, "", s["n"], s["total"], s["p50"], s["p95"], s["max"]])
+            for counter, values in summary["contadores"].items():
+                for value, n in values.items():
+                    w.writerow(["contador", counter, value, n, "", "", "", ""])
+        return json_path, csv_path
+
+    def write_prometheus(self, path):
+        """Formato de texto de Prometheus (p. ej. para el textfile collector de node_exporter)."""
+        summary = self.summary()
+        name = f"{PROMETHEUS_PREFIX}_paso_segundos"
+        lines = [f"# HELP {name} Latencia de cada paso del envío.", f"# TYPE {name} histogram"]
+        for step, s in summary["pasos"].items():
+            label = f'paso="{_prom_label(step)}"'
+            for bound, n in s["buckets"].items():
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {s["n"]}')
+            lines.append(f"{name}_sum{{{label}}} {s['total']}")
+            lines.append(f"{name}_count{{{label}}} {s['n']}")
+        name = f"{PROMETHEUS_PREFIX}_eventos_total"
+        lines += [f"# HELP {name} Métodos, selectores y estados usados en el envío.", f"# TYPE {name} counter"]
+        for counter, values in summary["contadores"].items():
+            for value, n in values.items():
+                lines.append(f'{name}{{contador="{_prom_label(counter)}",valor="{_prom_label(value)}"}} {n}')
+        # Escritura atómica: el recolector nunca ve un archivo a medias
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+# ---------------------------
+# Flujo: Excel + PDFs → participantes → envío
+# ---------------------------
+# Compartido por la ventana (App) y la línea de comandos (run_cli).
+
+def prepare_roster(df: pd.DataFrame, mapping):
+    """Completa el mapeo de columnas y agrega NOMBRES_CL, APELLIDOS_CL, CLAVE y NUM_WA a una copia de df."""
+    mapping = dict(mapping or {})
+    df = df.copy()
 
-def find_header_mapping_from_df(df: pd.DataFrame):
-    mapping = {"NOMBRES": None, "APELLIDOS": None, "TELEFONO": None}
     col_norm = {c: normalize_text(c) for c in df.columns}
-    for c, nc in col_norm.items():
-        if ("NOMB" in nc or "NAME" in nc or "NOMBRE" in nc) and mapping["NOMBRES"] is None:
-            mapping["NOMBRES"] = c
-        if ("APELL" in nc or "LAST" in nc or "APELLIDO" in nc) and mapping["APELLIDOS"] is None:
-            mapping["APELLIDOS"] = c
-        if any(k in nc for k in ("TEL", "CEL", "NUM", "PHONE")) and mapping["TELEFONO"] is None:
-            mapping["TELEFONO"] = c
+    detected = find_header_mapping_from_df(df, col_norm)
+    if not mapping.get("NOMBRES") and detected.get("NOMBRES"):
+        mapping["NOMBRES"] = detected["NOMBRES"]
+    if not mapping.get("APELLIDOS") and detected.get("APELLIDOS"):
+        mapping["APELLIDOS"] = detected["APELLIDOS"]
+    if not mapping.get("TELEFONO") and detected.get("TELEFONO"):
+        mapping["TELEFONO"] = detected["TELEFONO"]
 
-    if mapping["TELEFONO"] is None:
+    possible_names = [c for c in df.columns if any(tok in col_norm[c] for tok in ("NOMB","NAME"))]
+    possible_ap = [c for c in df.columns if any(tok in col_norm[c] for tok in ("APELL","LAST"))]
+    possible_tel = [c for c in df.columns if any(tok in col_norm[c] for tok in ("TEL","CEL","NUM","PHONE"))]
+
+    if not mapping.get("NOMBRES") and possible_names:
+        mapping["NOMBRES"] = possible_names[0]
+    if not mapping.get("APELLIDOS") and possible_ap:
+        mapping["APELLIDOS"] = possible_ap[0]
+    if not mapping.get("TELEFONO") and possible_tel:
+        mapping["TELEFONO"] = possible_tel[0]
+
+    if not mapping.get("TELEFONO"):
         for c in df.columns:
             try:
                 if candidate_is_phone_col(df[c]):
@@ -83,44 +2219,425 @@ def find_header_mapping_from_df(df: pd.DataFrame):
             except Exception:
                 continue
 
-    return mapping
+    df["NOMBRES_CL"] = normalize_series(df[mapping["NOMBRES"]]) if mapping.get("NOMBRES") else ""
+    df["APELLIDOS_CL"] = normalize_series(df[mapping["APELLIDOS"]]) if mapping.get("APELLIDOS") else ""
+    df["CLAVE"] = (df["NOMBRES_CL"].fillna("") + " " + df["APELLIDOS_CL"].fillna("")).str.strip()
+    if mapping.get("TELEFONO"):
+        df["NUM_WA"] = format_phone_series(df[mapping["TELEFONO"]])
+    else:
+        df["NUM_WA"] = ""
+    return df, mapping
 
-def read_excel_flexible(path):
+def build_participants(df: pd.DataFrame, mapping, pdf_paths):
+    """Cruza el Excel preparado con los PDFs. Devuelve (participantes, reporte de PDFs sin asignar)."""
+    matches, report = match_pdfs_to_roster(df, pdf_paths)
+    merged = df.assign(**{c: matches[c] for c in matches.columns})
+    merged["PDF_PATH"] = merged["PATH"].fillna("")
+    # Las rutas salen del índice recién actualizado: no hace falta un stat por fila
+    merged["ENCONTRADO"] = merged["PDF_PATH"] != ""
+    merged["NUM_WA"] = merged["NUM_WA"].fillna("")
+
+    n = len(merged)
+    def column(name):
+        return merged[name].tolist() if name in merged.columns else [""] * n
+    nombres = column(mapping.get("NOMBRES"))
+    apellidos = column(mapping.get("APELLIDOS"))
+    participants = []
+    for fila, (nom, ape, num, pdf, found, clave, coinc, conf) in enumerate(zip(
+            nombres, apellidos, column("NUM_WA"), column("PDF_PATH"), column("ENCONTRADO"),
+            column("CLAVE"), column("COINCIDENCIA"), column("CONFIANZA"))):
+        display_name = (str(nom) + " " + str(ape)).strip()
+        participants.append({
+            "NOMBRES": nom,
+            "APELLIDOS": ape,
+            "NUM_WA": num,
+            "PDF_PATH": pdf,
+            "ENCONTRADO": bool(found),
+            "CLAVE": clave,
+            "COINCIDENCIA": coinc,
+            "CONFIANZA": float(conf),
+            # Solo las coincidencias exactas se marcan solas; las PROBABLE las revisa el usuario
+            "SELECCIONADO": bool(found) and coinc == "EXACTO",
+            "display": display_name if display_name else clave,
+            "FILA": fila,  # posición en el Excel, para los campos de GreetingTemplate
+        })
+    return participants, report
+
+DEFAULT_GREETING = "Hola {NOMBRES}, te envío tu certificado. Saludos."
+
+def _cell_text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+class GreetingTemplate:
+    """Plantilla del saludo, compilada una vez por envío.
+
+    Los campos {…} pueden ser NOMBRES, APELLIDOS, TELEFONO o cualquier columna del Excel
+    (sin distinguir mayúsculas ni tildes). Un campo desconocido da ValueError al compilar.
+    """
+
+    PARTICIPANT_FIELDS = {"NOMBRES": "NOMBRES", "APELLIDOS": "APELLIDOS", "TELEFONO": "NUM_WA", "NUM WA": "NUM_WA"}
+
+    def __init__(self, text=DEFAULT_GREETING, roster=None):
+        self.text = text
+        columns = {} if roster is None else {normalize_text(c): c for c in roster.columns}
+        self.parts = []
+        for literal, field, _, _ in string.Formatter().parse(text):
+            if literal:
+                self.parts.append(literal)
+            if field is None:
+                continue
+            key = normalize_text(field)
+            if key in self.PARTICIPANT_FIELDS:
+                self.parts.append(lambda p, k=self.PARTICIPANT_FIELDS[key]: _cell_text(p.get(k)))
+            elif key in columns:
+                values = roster[columns[key]].tolist()
+                self.parts.append(lambda p, values=values: _cell_text(values[p["FILA"]]))
+            else:
+                raise ValueError(f"La plantilla usa {{{field}}}, que no es una columna del Excel.")
+
+    def render(self, p):
+        return "".join(part if isinstance(part, str) else part(p) for part in self.parts)
+
+def plan_recipients(recipients):
+    """Agrupa por número para enviar todos los PDFs de cada número en una sola visita al chat.
+
+    Devuelve (grupos, observaciones). Observaciones: (participante, "NUMERO_INVALIDO") para
+    números imposibles, que no se intentan, y (participante, "DUPLICADO") para filas con el
+    mismo número y el mismo PDF que otra, que se envía una sola vez.
+    """
+    groups = {}
+    seen = set()
+    issues = []
+    for p in recipients:
+        digits = re.sub(r"\D", "", str(p["NUM_WA"]))
+        if not wa_number_ok(digits):
+            issues.append((p, "NUMERO_INVALIDO"))
+            continue
+        if p["PDF_PATH"]:
+            key = (digits, os.path.normcase(os.path.abspath(p["PDF_PATH"])))
+            if key in seen:
+                issues.append((p, "DUPLICADO"))
+                continue
+            seen.add(key)
+        groups.setdefault(digits, []).append(p)
+    return list(groups.values()), issues
+
+def plan_summary(groups, issues, limit=20):
+    """Líneas de registro con el plan de envío: agrupación, duplicados y números inválidos."""
+    n = sum(len(g) for g in groups)
+    multi = [g for g in groups if len(g) > 1]
+    lines = [f"📋 {n} certificados para {len(groups)} números"
+             + (f"; {len(multi)} números reciben varios ({sum(len(g) for g in multi)} certificados)." if multi else ".")]
+    labels = {"NUMERO_INVALIDO": "⚠️ Número inválido, no se enviará", "DUPLICADO": "↩️ Duplicado (mismo número y PDF), se envía una vez"}
+    for p, estado in issues[:limit]:
+        lines.append(f"{labels[estado]}: {p['display']} ({p['NUM_WA'] or 'vacío'})")
+    if len(issues) > limit:
+        lines.append(f"... y {len(issues) - limit} observaciones más.")
+    return lines
+
+def match_summary(participants, report, limit=20):
+    """Líneas de registro con el resultado del cruce Excel ↔ PDFs."""
+    lines = [f"Combinación completa. PDFs detectados: {sum(1 for p in participants if p['ENCONTRADO'])} / {len(participants)}"]
+    probables = sum(1 for p in participants if p["COINCIDENCIA"] == "PROBABLE")
+    if probables:
+        lines.append(f"⚠️ {probables} coincidencias aproximadas sin marcar: revise el % de confianza y márquelas a mano.")
+    for r in report[:limit]:
+        cand = f" → {', '.join(r['CANDIDATOS'][:3])}" if r["CANDIDATOS"] else ""
+        lines.append(f"⚠️ PDF {r['ESTADO']}: {r['PDF']} ({r['CONFIANZA']:.0%}){cand}")
+    if len(report) > limit:
+        lines.append(f"... y {len(report) - limit} PDFs más sin asignar.")
+    return lines
+
+def send_and_report(recipients, sessions, out_dir, log, on_progress, should_stop, pacing=None, journal=None,
+                    prometheus_path=None, greeting=None, caption=False, navigation="url", compress=False,
+                    pipeline=False, resend_in_doubt=False):
+    """Envía con las sesiones dadas, reanudando desde el diario, y escribe ENVIADOS/NO_ENVIADOS
+    y las métricas del envío (METRICAS_<fecha>.json/.csv, y Prometheus si se pide).
+
+    greeting es una GreetingTemplate ya compilada (por defecto DEFAULT_GREETING); con
+    caption=True el saludo va como leyenda del PDF. navigation="app" abre los chats ya
+    existentes desde el buscador en lugar de recargar la página. Antes de enviar se revisan
+    los PDFs (PdfPreflight); con compress=True los grandes se envían como copia comprimida.
+    pipeline=True abre el chat siguiente apenas se confirma cada PDF, antes de la espera del
+    ritmo; solo acelera cuando el ritmo es lo que limita.
+    Quien quedó en un estado dudoso (IN_DOUBT_STATES) solo se reenvía con resend_in_doubt=True.
+    Sin journal se usa el diario de JOURNAL_PATH. Devuelve (enviados, no_enviados) según el diario.
+    """
+    metrics = SendMetrics()
+    greeting = greeting or GreetingTemplate()
+    checks = PdfPreflight().run([p["PDF_PATH"] for p in recipients if p["PDF_PATH"]], compress=compress, log=log)
+    for line in preflight_summary(checks):
+        log(line)
+    journal = journal or SendJournal()
     try:
-        df = pd.read_excel(path, engine="openpyxl")
-    except Exception:
-        df = pd.read_excel(path)
-    mapping = find_header_mapping_from_df(df)
-    if all(mapping.values()):
-        return df, mapping
-
-    raw = pd.read_excel(path, header=None, engine="openpyxl")
-    header_row_index = None
-    for r in range(min(8, len(raw))):
-        row = raw.iloc[r].fillna("").astype(str).tolist()
-        tmp_cols = {}
-        for i, cell in enumerate(row):
-            nc = normalize_text(cell)
-            tmp_cols[i] = nc
-        has_name = any("NOMB" in v or "NOMBRE" in v or "NAME" in v for v in tmp_cols.values())
-        has_ap = any("APELL" in v or "APELLIDO" in v or "LAST" in v for v in tmp_cols.values())
-        has_tel = any("TEL" in v or "CEL" in v or "NUM" in v or "PHONE" in v for v in tmp_cols.values())
-        if (has_name and has_ap) or has_tel:
-            header_row_index = r
-            break
-    if header_row_index is not None:
-        df2 = pd.read_excel(path, header=header_row_index, engine="openpyxl")
-        mapping = find_header_mapping_from_df(df2)
-        return df2, mapping
+        # Reanudación: quien ya figura como ENVIADO en el diario no se vuelve a enviar, y
+        # quien quedó en duda solo si se pidió
+        pending, already_sent, in_doubt = [], 0, []
+        for p in recipients:
+            state = journal.state(p)
+            if state == "ENVIADO":
+                already_sent += 1
+                continue
+            if state in IN_DOUBT_STATES and not resend_in_doubt:
+                in_doubt.append(p)
+                continue
+            check = checks.get(p["PDF_PATH"])
+            if check and check["estado"] not in PREFLIGHT_SENDABLE:
+                journal.record(p, check["estado"])
+                continue
+            if check and check["copia"]:
+                p["PDF_ENVIO"] = check["copia"]
+            journal.record(p, "PENDIENTE")
+            p["SALUDO_TEXTO"] = greeting.render(p)
+            pending.append(p)
+        if already_sent:
+            log(f"⏭️ {already_sent} ya recibieron su certificado en un envío anterior; se omiten.")
+        if in_doubt:
+            log(f"⚠️ {len(in_doubt)} quedaron en duda en un envío anterior (el PDF pudo haber llegado); "
+                "no se reenvían. Revise esos chats:")
+            for p in in_doubt[:20]:
+                log(f"   {p['display']} ({p['NUM_WA']}): {journal.state(p)}")
+            if len(in_doubt) > 20:
+                log(f"   ... y {len(in_doubt) - 20} más (figuran en NO_ENVIADOS).")
+        groups, issues = plan_recipients(pending)
+        for line in plan_summary(groups, issues):
+            log(line)
+        for p, estado in issues:
+            # Un DUPLICADO comparte la fila del diario con el original: no se registra aparte
+            if estado == "NUMERO_INVALIDO":
+                journal.record(p, estado)
 
-    return df, mapping
+        scheduler = SendScheduler(sessions, log, on_progress, should_stop, pacing=pacing, journal=journal,
+                                  metrics=metrics, caption=caption, navigation=navigation, pipeline=pipeline)
+        scheduler.run(groups)
+        if should_stop():
+            log("🚫 Envío detenido por el usuario.")
+
+        # Guardar resultados (siempre a partir del diario); en lote, cada evento en su carpeta
+        by_dir = {}
+        for p in recipients:
+            by_dir.setdefault(p.get("CARPETA_REPORTE") or out_dir, []).append(p)
+        reports = {folder: journal.report(group) for folder, group in by_dir.items()}
+    finally:
+        journal.close()
+    sent, not_sent = [], []
+    for folder, (folder_sent, folder_not_sent) in reports.items():
+        if folder_sent:
+            pd.DataFrame(folder_sent, columns=REPORT_COLUMNS).to_excel(os.path.join(folder, "ENVIADOS.xlsx"), index=False)
+        if folder_not_sent:
+            pd.DataFrame(folder_not_sent, columns=REPORT_COLUMNS).to_excel(os.path.join(folder, "NO_ENVIADOS.xlsx"),
+                                                                          index=False)
+        if folder != out_dir:
+            log(f"🗂️ {os.path.basename(os.path.dirname(folder))}: {len(folder_sent)} enviados, "
+                f"{len(folder_not_sent)} no enviados → {folder}")
+        sent += folder_sent
+        not_sent += folder_not_sent
+    steps = metrics.summary()["pasos"]
+    if steps:
+        metrics.write(out_dir)
+        if prometheus_path:
+            metrics.write_prometheus(prometheus_path)
+        log("⏱️ Mediana por paso: " + " · ".join(f"{step} {s['p50']:.1f} s" for step, s in steps.items()))
+    log(f"🗂️ Resultados guardados en {out_dir}")
+    return sent, not_sent
+
+# ---------------------------
+# Lotes de eventos
+# ---------------------------
+# Estructura de cada evento: <evento>/ArchivoXLSM/<lista>.xlsx y <evento>/CERTIFICADOS_PDF/
+
+EVENT_ROSTER_DIR = "ArchivoXLSM"
+EVENT_PDF_DIR = "CERTIFICADOS_PDF"
+EVENT_EXCEL_EXTENSIONS = (".xlsx", ".xlsm", ".xls")
+REPORT_FILES = {"ENVIADOS.XLSX", "NO_ENVIADOS.XLSX"}  # los escribe send_and_report, no son listas
+EVENT_MAX_WORKERS = 4
+
+def find_event_roster(roster_dir, event_name):
+    """Excel con la lista del evento: CERTIFICADOS_<evento> si existe, si no el más reciente.
+
+    Se descartan los reportes del envío (ENVIADOS/NO_ENVIADOS), las métricas y los
+    archivos temporales de Excel (~$). None si no queda ninguno.
+    """
+    candidates = []
+    for e in os.scandir(roster_dir):
+        name = e.name.upper()
+        if (not e.is_file() or not name.endswith(tuple(x.upper() for x in EVENT_EXCEL_EXTENSIONS))
+                or name in REPORT_FILES or name.startswith(("~$", "METRICAS_"))):
+            continue
+        if os.path.splitext(name)[0] == f"CERTIFICADOS_{event_name}".upper():
+            return e.path
+        candidates.append((e.stat().st_mtime, e.path))
+    return max(candidates)[1] if candidates else None
+
+def discover_events(root):
+    """Eventos bajo root (a cualquier profundidad), ordenados por nombre.
+
+    Cada uno es {"nombre", "excel", "pdfs", "salida"}: salida es su ArchivoXLSM, donde
+    quedan ENVIADOS/NO_ENVIADOS.
+    """
+    events = []
+    for folder, dirnames, _ in os.walk(root):
+        if EVENT_ROSTER_DIR in dirnames and EVENT_PDF_DIR in dirnames:
+            name = os.path.basename(folder)
+            roster_dir = os.path.join(folder, EVENT_ROSTER_DIR)
+            excel = find_event_roster(roster_dir, name)
+            if excel:
+                events.append({"nombre": name, "excel": excel, "pdfs": os.path.join(folder, EVENT_PDF_DIR),
+                               "salida": roster_dir})
+            dirnames[:] = []  # dentro de un evento no hay otros eventos
+    return sorted(events, key=lambda e: e["nombre"])
+
+def load_event(event):
+    """Lee y cruza un evento (corre en un proceso aparte). Devuelve (roster, participantes, reporte)."""
+    df, mapping = read_excel_flexible(event["excel"])
+    df, mapping = prepare_roster(df, mapping)
+    index = PdfFolderIndex(event["pdfs"])
+    index.refresh()
+    participants, report = build_participants(df, mapping, [path for path, _, _ in index.files()])
+    for p in participants:
+        p["EVENTO"] = event["nombre"]
+        p["CARPETA_REPORTE"] = event["salida"]
+    return df, participants, report
+
+def load_events(events, workers=None):
+    """Carga los eventos en paralelo. Devuelve [(evento, (roster, participantes, reporte) o excepción)]."""
+    workers = min(workers or os.cpu_count() or 1, EVENT_MAX_WORKERS, len(events))
+    if workers <= 1:
+        futures = None
+    else:
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            futures = [pool.submit(load_event, e) for e in events]
+        except Exception:  # sin procesos disponibles: se carga en este mismo proceso
+            futures = None
+    results = []
+    for i, event in enumerate(events):
+        try:
+            results.append((event, futures[i].result() if futures else load_event(event)))
+        except Exception as e:
+            results.append((event, e))
+    if futures:
+        pool.shutdown()
+    return results
+
+class EventGreeting:
+    """Saludo de un envío en lote: cada evento usa la plantilla compilada con su propio Excel."""
+
+    def __init__(self, templates):
+        self.templates = templates
+
+    def render(self, p):
+        return self.templates[p["EVENTO"]].render(p)
 
 # ---------------------------
 # App GUI + Lógica
 # ---------------------------
 
-class App(tk.Tk):
-    def __init__(self):
+UI_POLL_MS = 100               # cada cuánto el hilo de Tk procesa eventos de los hilos de trabajo
+UI_MAX_EVENTS_PER_TICK = 500
+LOG_MAX_LINES = 2000           # líneas que conserva el registro en pantalla
+
+class ParticipantTable(tk.Frame if tk else object):
+    """Tabla virtual de participantes: solo existen en Tk las filas visibles.
+
+    El estado de "Enviar" vive en cada participante (clave "SELECCIONADO"); al
+    desplazarse se reescriben los valores de las mismas filas del Treeview.
+    """
+
+    COLUMNS = (
+        ("sel", "Enviar", 70, "center"),
+        ("nombre", "Nombre completo", 330, "w"),
+        ("tel", "Teléfono (WA)", 150, "center"),
+        ("pdf", "PDF encontrado", 330, "w"),
+    )
+
+    def __init__(self, master, **kw):
+        super().__init__(master, **kw)
+        self.rows = []
+        self.offset = 0
+        self.visible = 1
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in self.COLUMNS], show="headings",
+                                 selectmode="none", height=1)
+        for key, text, width, anchor in self.COLUMNS:
+            self.tree.heading(key, text=text)
+            self.tree.column(key, width=width, anchor=anchor, stretch=(key != "sel"))
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.tree.bind("<Button-1>", self.on_click)
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_to(self.offset - (3 if e.delta > 0 else -3)))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.offset - 3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.offset + 3))
+
+    @staticmethod
+    def row_values(p):
+        pdf_text = (os.path.basename(p["PDF_PATH"]) if p["PDF_PATH"] else "No")
+        if p["COINCIDENCIA"] == "PROBABLE":
+            pdf_text += f" ({p['CONFIANZA']:.0%})"
+        return ("☑" if p["SELECCIONADO"] else "☐", p["display"], p["NUM_WA"],
+                ("✅ " if p["ENCONTRADO"] else "❌ ") + pdf_text)
+
+    def set_rows(self, rows):
+        self.rows = rows
+        self.offset = 0
+        self.redraw()
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.rows) - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self.redraw()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.rows)))
+        elif action == "scroll":
+            step = self.visible if unit == "pages" else 1
+            self.scroll_to(self.offset + int(amount) * step)
+
+    def on_resize(self, event):
+        style = ttk.Style(self)
+        row_height = int(style.lookup("Treeview", "rowheight") or 20)
+        visible = max(1, (event.height - 26) // row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.offset = max(0, min(self.offset, len(self.rows) - self.visible))
+            self.redraw()
+
+    def on_click(self, event):
+        if self.tree.identify_region(event.x, event.y) != "cell" or self.tree.identify_column(event.x) != "#1":
+            return
+        item = self.tree.identify_row(event.y)
+        if not item:
+            return
+        p = self.rows[self.offset + int(item)]
+        p["SELECCIONADO"] = not p["SELECCIONADO"]
+        self.tree.item(item, values=self.row_values(p))
+
+    def redraw(self):
+        count = max(0, min(self.visible, len(self.rows) - self.offset))
+        existing = self.tree.get_children()
+        for item in existing[count:]:
+            self.tree.delete(item)
+        for i in range(count):
+            values = self.row_values(self.rows[self.offset + i])
+            if i < len(existing):
+                self.tree.item(existing[i], values=values)
+            else:
+                self.tree.insert("", "end", iid=str(i), values=values)
+        if self.rows:
+            self.scrollbar.set(self.offset / len(self.rows), (self.offset + count) / len(self.rows))
+        else:
+            self.scrollbar.set(0, 1)
+
+class App(tk.Tk if tk else object):
+    def __init__(self, prelaunch=PRELAUNCH_BROWSER):
         super().__init__()
         self.title("Envío de Certificados por WhatsApp (v8)")
         self.geometry("980x720")
@@ -131,13 +2648,20 @@ class App(tk.Tk):
 
         self.excel_path = None
         self.pdf_folder = None
+        self.pdf_index = None
         self.df_excel = None
+        self.roster = None  # Excel preparado del último cruce (campos de la plantilla)
         self.mapping = None
         self.participants = []
-        self.driver = None
+        self.sessions = []
+        self.pacing = None  # ritmo por defecto (PACING) hasta que se ajuste en edit_pacing
         self.stop_sending = False
+        self.ui_events = queue.Queue()
 
         self.build_ui()
+        self.after(UI_POLL_MS, self.drain_ui_events)
+        if prelaunch:
+            self.after(500, self.prelaunch_browser)
 
     def build_ui(self):
         tk.Label(self, text="Envío de Certificados por WhatsApp", font=self.title_font).pack(pady=10)
@@ -150,12 +2674,38 @@ class App(tk.Tk):
                   command=self.select_pdf_folder).grid(row=0, column=1, padx=8)
         tk.Button(top, text="🌐 Abrir WhatsApp Web", font=self.big_font, bg="#128C7E", fg="white",
                   command=self.open_whatsapp).grid(row=0, column=2, padx=8)
+        tk.Label(top, text="Sesiones:", font=self.small_font).grid(row=0, column=3, padx=(8, 2))
+        self.var_sessions = tk.StringVar(value="1")
+        tk.Spinbox(top, from_=1, to=MAX_SESSIONS, width=3, textvariable=self.var_sessions,
+                   font=self.big_font, state="readonly").grid(row=0, column=4)
 
         self.lbl_excel = tk.Label(self, text="Archivo Excel: —", font=self.small_font)
         self.lbl_excel.pack(anchor="w", padx=12)
         self.lbl_pdfs = tk.Label(self, text="Carpeta PDFs: —", font=self.small_font)
         self.lbl_pdfs.pack(anchor="w", padx=12)
 
+        msg = tk.Frame(self)
+        msg.pack(fill="x", padx=12, pady=(6, 0))
+        tk.Label(msg, text="Mensaje:", font=self.small_font).pack(side="left")
+        self.var_greeting = tk.StringVar(value=DEFAULT_GREETING)
+        tk.Entry(msg, textvariable=self.var_greeting, font=self.small_font).pack(side="left", fill="x", expand=True, padx=6)
+        self.var_caption = tk.BooleanVar(value=False)
+        tk.Checkbutton(msg, text="Como leyenda del PDF (un solo envío)", variable=self.var_caption,
+                       font=self.small_font).pack(side="left")
+
+        options = tk.Frame(self)
+        options.pack(fill="x", padx=12)
+        self.var_app_nav = tk.BooleanVar(value=False)
+        tk.Checkbutton(options, text="Abrir chats existentes sin recargar", variable=self.var_app_nav,
+                       font=self.small_font).pack(side="left")
+        self.var_pipeline = tk.BooleanVar(value=False)
+        tk.Checkbutton(options, text="Precargar el siguiente chat", variable=self.var_pipeline,
+                       font=self.small_font).pack(side="left", padx=(8, 0))
+        self.var_compress = tk.BooleanVar(value=False)
+        tk.Checkbutton(options, text=f"Comprimir PDFs de más de {PDF_COMPRESS_ABOVE_MB} MB",
+                       variable=self.var_compress, font=self.small_font).pack(side="left", padx=(8, 0))
+        tk.Button(options, text="⏱️ Ritmo…", font=self.small_font, command=self.edit_pacing).pack(side="right")
+
         frame_list = tk.LabelFrame(self, text="Participantes (marque a quién enviar)", font=self.big_font)
         frame_list.pack(fill="both", expand=True, padx=10, pady=10)
 
@@ -166,14 +2716,8 @@ class App(tk.Tk):
                        font=self.small_font).pack(side="left", padx=8)
         tk.Button(ctrl, text="🔄 Actualizar", font=self.small_font, command=self.combine_and_refresh).pack(side="left", padx=8)
 
-        canvas = tk.Canvas(frame_list)
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar = ttk.Scrollbar(frame_list, orient="vertical", command=canvas.yview)
-        scrollbar.pack(side="right", fill="y")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        self.rows_frame = tk.Frame(canvas)
-        canvas.create_window((0, 0), window=self.rows_frame, anchor="nw")
-        self.rows_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+        self.table = ParticipantTable(frame_list)
+        self.table.pack(fill="both", expand=True)
 
         bottom = tk.Frame(self)
         bottom.pack(fill="x", pady=6)
@@ -185,18 +2729,72 @@ class App(tk.Tk):
         self.btn_stop.pack(side="left", padx=6)
         self.progress = ttk.Progressbar(bottom, orient="horizontal", mode="determinate")
         self.progress.pack(side="left", fill="x", expand=True, padx=10)
+        self.lbl_eta = tk.Label(bottom, text="", font=self.small_font)
+        self.lbl_eta.pack(side="left", padx=8)
 
         log_frame = tk.LabelFrame(self, text="Registro", font=self.small_font)
         log_frame.pack(fill="both", expand=False, padx=10, pady=8)
         self.log_box = tk.Text(log_frame, height=8, state="disabled", font=("Arial", 11))
         self.log_box.pack(fill="both", expand=True)
 
+    # ------------------ Canal de eventos hacia la UI ------------------
+    # Los hilos de trabajo nunca tocan Tk: publican eventos en self.ui_events y el
+    # hilo principal los procesa por lotes cada UI_POLL_MS.
+
+    def post(self, kind, *args):
+        self.ui_events.put((kind, args))
+
     def log(self, msg: str):
+        self.post("log", f"{time.strftime('%H:%M:%S')} - {msg}")
+
+    def drain_ui_events(self):
+        lines = []
+        progress = None
+        try:
+            for _ in range(UI_MAX_EVENTS_PER_TICK):
+                kind, args = self.ui_events.get_nowait()
+                if kind == "log":
+                    lines.append(args[0])
+                elif kind == "progress":
+                    progress = args
+                else:
+                    if lines:
+                        self.append_log(lines)
+                        lines = []
+                    getattr(self, f"on_{kind}")(*args)
+        except queue.Empty:
+            pass
+        if lines:
+            self.append_log(lines)
+        if progress is not None:
+            value, maximum, eta = progress
+            self.progress.config(maximum=maximum, value=value)
+            self.lbl_eta.config(text=f"{value}/{maximum} · faltan {format_eta(eta)}" if value < maximum else "")
+        self.after(UI_POLL_MS, self.drain_ui_events)
+
+    def append_log(self, lines):
         self.log_box.config(state="normal")
-        self.log_box.insert("end", f"{time.strftime('%H:%M:%S')} - {msg}\n")
+        self.log_box.insert("end", "\n".join(lines) + "\n")
+        # Búfer circular: se descartan las líneas más antiguas
+        excess = int(self.log_box.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.log_box.delete("1.0", f"{excess + 1}.0")
         self.log_box.see("end")
         self.log_box.config(state="disabled")
 
+    def set_progress(self, value, maximum, eta=None):
+        self.post("progress", value, maximum, eta)
+
+    def on_sending_done(self, n_sent=None, n_not_sent=None):
+        self.btn_send.config(state="normal")
+        self.btn_stop.config(state="disabled")
+        if n_sent is not None:
+            messagebox.showinfo("Proceso finalizado", f"✅ Enviados: {n_sent} | ❌ No enviados: {n_not_sent}")
+
+    def on_sending_error(self, message):
+        messagebox.showerror("Error en el envío", f"El envío se interrumpió:\n\n{message}\n\n"
+                             "Lo ya enviado quedó en el diario; al volver a enviar no se repite.")
+
     # ------------------ Excel & PDFs ------------------
 
     def select_excel(self):
@@ -209,7 +2807,7 @@ class App(tk.Tk):
             df, mapping = read_excel_flexible(path)
             self.df_excel = df
             self.mapping = mapping
-            self.log(f"Excel cargado: {path} (filas: {len(df)})")
+            self.log(f"Excel cargado: {path} (hoja: {df.attrs.get('sheet', '—')}, filas: {len(df)})")
             mm = {k: (v if v else "NO_DETECTADA") for k, v in mapping.items()}
             self.log(f"Mapeo detectado: {mm}")
             if not mapping.get("TELEFONO"):
@@ -238,395 +2836,402 @@ class App(tk.Tk):
             messagebox.showwarning("Falta carpeta PDFs", "Primero selecciona la carpeta de PDFs.")
             return
 
-        mapping = self.mapping or {}
-        df = self.df_excel.copy()
-
-        detected = find_header_mapping_from_df(df)
-        if not mapping.get("NOMBRES") and detected.get("NOMBRES"):
-            mapping["NOMBRES"] = detected["NOMBRES"]
-        if not mapping.get("APELLIDOS") and detected.get("APELLIDOS"):
-            mapping["APELLIDOS"] = detected["APELLIDOS"]
-        if not mapping.get("TELEFONO") and detected.get("TELEFONO"):
-            mapping["TELEFONO"] = detected["TELEFONO"]
-
-        possible_names = [c for c in df.columns if any(tok in normalize_text(c) for tok in ("NOMB","NAME"))]
-        possible_ap = [c for c in df.columns if any(tok in normalize_text(c) for tok in ("APELL","LAST"))]
-        possible_tel = [c for c in df.columns if any(tok in normalize_text(c) for tok in ("TEL","CEL","NUM","PHONE"))]
-
-        if not mapping.get("NOMBRES") and possible_names:
-            mapping["NOMBRES"] = possible_names[0]
-        if not mapping.get("APELLIDOS") and possible_ap:
-            mapping["APELLIDOS"] = possible_ap[0]
-        if not mapping.get("TELEFONO") and possible_tel:
-            mapping["TELEFONO"] = possible_tel[0]
-
-        if not mapping.get("TELEFONO"):
-            for c in df.columns:
-                try:
-                    if candidate_is_phone_col(df[c]):
-                        mapping["TELEFONO"] = c
-                        break
-                except Exception:
-                    continue
-
-        self.mapping = mapping
-
         try:
-            df["NOMBRES_CL"] = df[mapping["NOMBRES"]].apply(normalize_text) if mapping.get("NOMBRES") else ""
-            df["APELLIDOS_CL"] = df[mapping["APELLIDOS"]].apply(normalize_text) if mapping.get("APELLIDOS") else ""
-            df["CLAVE"] = (df["NOMBRES_CL"].fillna("") + " " + df["APELLIDOS_CL"].fillna("")).str.strip()
-            if mapping.get("TELEFONO"):
-                df["NUM_WA"] = df[mapping["TELEFONO"]].apply(format_peru_phone)
-            else:
-                df["NUM_WA"] = ""
+            df, self.mapping = prepare_roster(self.df_excel, self.mapping)
         except Exception as e:
             messagebox.showerror("Error", f"No se pudieron normalizar columnas:\n{e}")
             self.log(f"Error normalizando: {e}")
             return
 
-        pdf_files = [f for f in os.listdir(self.pdf_folder) if f.lower().endswith(".pdf")]
-        pdf_rows = []
-        for p in pdf_files:
-            fn = os.path.join(self.pdf_folder, p)
-            n, a = extract_firstname_lastname_from_pdf(p)
-            clave = (normalize_text(n) + " " + normalize_text(a)).strip()
-            pdf_rows.append({"PDF": p, "CLAVE": clave, "PATH": fn})
-
-        df_pdfs = pd.DataFrame(pdf_rows)
-        if df_pdfs.empty:
-            df_pdfs = pd.DataFrame(columns=["PDF","CLAVE","PATH"])
-
-        merged = pd.merge(df, df_pdfs, on="CLAVE", how="left", validate="m:1")
-        merged["PDF_PATH"] = merged["PATH"].fillna("")
-        merged["ENCONTRADO"] = merged["PDF_PATH"].apply(lambda x: bool(x) and os.path.exists(x))
-        merged["NUM_WA"] = merged["NUM_WA"].fillna("")
+        if self.pdf_index is None or self.pdf_index.root != os.path.abspath(self.pdf_folder):
+            self.pdf_index = PdfFolderIndex(self.pdf_folder)
+        try:
+            n_dirs, rescanned = self.pdf_index.refresh()
+        except OSError as e:
+            messagebox.showerror("Error", f"No se pudo leer la carpeta de PDFs:\n{e}")
+            self.log(f"Error leyendo carpeta de PDFs: {e}")
+            return
+        self.log(f"Índice de PDFs: {len(self.pdf_index)} archivos en {n_dirs} carpetas ({rescanned} releídas).")
 
-        self.participants = []
-        for _, row in merged.iterrows():
-            display_name = (str(row.get(mapping["NOMBRES"], "")) + " " + str(row.get(mapping["APELLIDOS"], ""))).strip()
-            self.participants.append({
-                "NOMBRES": row.get(mapping["NOMBRES"], ""),
-                "APELLIDOS": row.get(mapping["APELLIDOS"], ""),
-                "NUM_WA": row.get("NUM_WA", ""),
-                "PDF_PATH": row.get("PDF_PATH", ""),
-                "ENCONTRADO": bool(row.get("ENCONTRADO", False)),
-                "CLAVE": row.get("CLAVE", ""),
-                "var": tk.BooleanVar(value=bool(row.get("ENCONTRADO", False))),
-                "display": display_name if display_name else row.get("CLAVE", "")
-            })
+        pdf_files = [path for path, _, _ in self.pdf_index.files()]
+        self.participants, report = build_participants(df, self.mapping, pdf_files)
+        self.roster = df
 
         self.show_participants()
         self.btn_send.config(state="normal")
-        self.log(f"Combinación completa. PDFs detectados: {sum(1 for p in self.participants if p['ENCONTRADO'])} / {len(self.participants)}")
+        for line in match_summary(self.participants, report):
+            self.log(line)
+
+    def edit_pacing(self):
+        """Ventana para ajustar el ritmo de envío (PACING_SETTINGS) de los próximos envíos."""
+        current = check_pacing(self.pacing)
+        win = tk.Toplevel(self)
+        win.title("Ritmo de envío")
+        win.transient(self)
+        win.grab_set()
+        fields = {}
+        for row, (key, label) in enumerate(PACING_SETTINGS.items()):
+            tk.Label(win, text=label, font=self.small_font).grid(row=row, column=0, sticky="w", padx=8, pady=2)
+            fields[key] = tk.StringVar(value=str(current[key]))
+            tk.Entry(win, textvariable=fields[key], width=8, font=self.small_font).grid(row=row, column=1, padx=8)
+
+        def save():
+            try:
+                values = {key: (int if isinstance(PACING[key], int) else float)(var.get().replace(",", "."))
+                          for key, var in fields.items()}
+            except ValueError:
+                messagebox.showerror("Ritmo inválido", "Revise los números (la cuota y los éxitos van sin decimales).",
+                                     parent=win)
+                return
+            try:
+                self.pacing = check_pacing(values)
+            except ValueError as e:
+                messagebox.showerror("Ritmo inválido", str(e), parent=win)
+                return
+            self.log(f"⏱️ Ritmo: {self.pacing['rate']:g} mensajes/min por sesión, "
+                     f"máximo {self.pacing['hourly_quota']} por hora.")
+            win.destroy()
+
+        buttons = tk.Frame(win)
+        buttons.grid(row=len(PACING_SETTINGS), column=0, columnspan=2, pady=8)
+        tk.Button(buttons, text="Guardar", font=self.small_font, command=save).pack(side="left", padx=6)
+        tk.Button(buttons, text="Valores por defecto", font=self.small_font,
+                  command=lambda: [var.set(str(PACING[key])) for key, var in fields.items()]).pack(side="left", padx=6)
+        tk.Button(buttons, text="Cancelar", font=self.small_font, command=win.destroy).pack(side="left", padx=6)
 
     def show_participants(self):
-        for w in self.rows_frame.winfo_children():
-            w.destroy()
-        headers = ["Enviar", "Nombre completo", "Teléfono (WA)", "PDF encontrado"]
-        for j, h in enumerate(headers):
-            tk.Label(self.rows_frame, text=h, font=self.small_font, borderwidth=0,
-                     width=(12 if j==0 else 40)).grid(row=0, column=j, sticky="w", padx=4, pady=2)
-        for i, p in enumerate(self.participants, start=1):
-            tk.Checkbutton(self.rows_frame, variable=p["var"]).grid(row=i, column=0, padx=6)
-            tk.Label(self.rows_frame, text=p["display"], anchor="w").grid(row=i, column=1, sticky="w")
-            tk.Label(self.rows_frame, text=p["NUM_WA"]).grid(row=i, column=2)
-            tk.Label(self.rows_frame, text=( "✅ " if p["ENCONTRADO"] else "❌ " ) + (os.path.basename(p["PDF_PATH"]) if p["PDF_PATH"] else "No"),
-                     anchor="w").grid(row=i, column=3, sticky="w")
+        self.table.set_rows(self.participants)
 
     def toggle_all(self):
         val = self.var_all.get()
         for p in self.participants:
-            p["var"].set(val)
+            p["SELECCIONADO"] = val
+        self.table.redraw()
 
     # ------------------ WhatsApp & envío ------------------
 
     def open_whatsapp(self):
+        wanted = max(1, min(MAX_SESSIONS, int(self.var_sessions.get())))
         try:
-            if self.driver is None:
-                options = webdriver.ChromeOptions()
-                profile_dir = os.path.join(os.getcwd(), "whatsapp_profile_v8")
-                options.add_argument(f"--user-data-dir={profile_dir}")
-                options.add_argument("window-size=1200,900")
-                options.add_argument("--disable-notifications")
-                self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-            self.driver.get("https://web.whatsapp.com")
-            messagebox.showinfo("WhatsApp Web", "Se abrió WhatsApp Web. Escanea el QR con tu teléfono si es necesario.\n\nCuando aparezcan tus chats, puedes iniciar el envío.")
-            def wait_login():
-                try:
-                    WebDriverWait(self.driver, 180).until(EC.presence_of_element_located((By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]')))
-                    self.log("WhatsApp Web: sesión detectada.")
-                except Exception:
-                    self.log("No se detectó inicio de sesión en el tiempo esperado.")
-            threading.Thread(target=wait_login, daemon=True).start()
+            while len(self.sessions) < wanted:
+                index = len(self.sessions)
+                self.sessions.append(WhatsAppSession(index, self.session_logger(index, wanted)))
+            for s in self.sessions[wanted:]:
+                s.quit()
+            self.sessions = self.sessions[:wanted]
+            for s in self.sessions:
+                s.log = self.session_logger(s.index, wanted)
+                s.open()
+            messagebox.showinfo("WhatsApp Web", f"Se abrió WhatsApp Web en {wanted} ventana(s). Escanea el QR con tu teléfono si es necesario.\n\nCuando aparezcan tus chats, puedes iniciar el envío.")
+            for s in self.sessions:
+                threading.Thread(target=s.wait_login, daemon=True).start()
         except Exception as e:
             messagebox.showerror("Error abrir WhatsApp", f"No se pudo abrir WhatsApp Web:\n{e}")
             self.log(f"Error abrir WhatsApp: {e}")
 
+    def prelaunch_browser(self):
+        """Deja Chrome cargando WhatsApp Web mientras se eligen el Excel y los PDFs."""
+        try:
+            session = WhatsAppSession(0, self.log)
+        except ImportError as e:
+            self.log(f"No se pudo preparar el navegador: {e}")
+            return
+        self.sessions.append(session)
+        session.launch_async()
+
+    def session_logger(self, index, count):
+        if count == 1:
+            return self.log
+        return lambda msg: self.log(f"[S{index + 1}] {msg}")
+
     def start_sending(self):
-        selected = [p for p in self.participants if p["var"].get()]
+        selected = [p for p in self.participants if p["SELECCIONADO"]]
         if not selected:
             messagebox.showwarning("Sin selección", "No hay participantes seleccionados para enviar.")
             return
-        if not self.driver:
+        if not any(s.driver for s in self.sessions):
             messagebox.showwarning("WhatsApp no abierto", "Abre WhatsApp Web primero.")
             return
-        if not messagebox.askyesno("Confirmar envío", f"Se enviarán {len(selected)} certificados. ¿Continuar?"):
+        try:
+            greeting = GreetingTemplate(self.var_greeting.get(), self.roster)
+        except ValueError as e:
+            messagebox.showerror("Mensaje inválido", str(e))
+            return
+        example = greeting.render(selected[0])
+        groups, issues = plan_recipients(selected)
+        for line in plan_summary(groups, issues):
+            self.log(line)
+        notes = Counter(estado for _, estado in issues)
+        plan = f"Se enviarán {sum(len(g) for g in groups)} certificados a {len(groups)} números"
+        if notes:
+            plan += (f" (se omiten {notes['DUPLICADO']} duplicados y {notes['NUMERO_INVALIDO']} números inválidos;"
+                     " detalle en el registro)")
+        if not messagebox.askyesno("Confirmar envío", f"{plan}, con el mensaje:\n\n{example}\n\n¿Continuar?"):
             return
+        journal = SendJournal()
+        try:
+            in_doubt = journal.in_doubt([p for g in groups for p in g])
+        finally:
+            journal.close()
+        resend_in_doubt = False
+        if in_doubt:
+            names = "\n".join(f"• {p['display']} ({p['NUM_WA']})" for p in in_doubt[:15])
+            if len(in_doubt) > 15:
+                names += f"\n... y {len(in_doubt) - 15} más"
+            resend_in_doubt = messagebox.askyesno(
+                "Envíos en duda",
+                f"{len(in_doubt)} participantes quedaron en duda en un envío anterior (el PDF pudo haber "
+                f"llegado):\n\n{names}\n\n¿Reenviarles el certificado? Con «No» se omiten y quedan en NO_ENVIADOS.")
         self.stop_sending = False
         self.btn_send.config(state="disabled")
         self.btn_stop.config(state="normal")
-        threading.Thread(target=self.process_sending, args=(selected,), daemon=True).start()
+        navigation = "app" if self.var_app_nav.get() else "url"
+        threading.Thread(target=self.process_sending, args=(selected, greeting, self.var_caption.get(), navigation,
+                                                            self.var_compress.get(), self.var_pipeline.get(),
+                                                            resend_in_doubt),
+                         daemon=True).start()
 
     def stop_sending_action(self):
         self.stop_sending = True
         self.log("Solicitud de detener el envío recibida. Esperando terminar envío en curso...")
 
-    def send_text_message(self, message_text):
-        """Envía un mensaje de texto usando múltiples métodos"""
-        try:
-            # Método 1: JavaScript directo (más confiable)
-            js_code = """
-            function sendMessage(text) {
-                const textbox = document.querySelector('div[contenteditable="true"][data-tab="10"]');
-                if (!textbox) return false;
-                
-                // Limpiar y establecer el texto
-                textbox.innerHTML = '';
-                textbox.textContent = text;
-                
-                // Disparar eventos necesarios
-                const inputEvent = new InputEvent('input', { bubbles: true, inputType: 'insertText', data: text });
-                textbox.dispatchEvent(inputEvent);
-                
-                // Pequeña espera para que WhatsApp procese
-                setTimeout(() => {
-                    const sendBtn = document.querySelector('button[data-tab="11"]');
-                    if (sendBtn) {
-                        sendBtn.click();
-                    }
-                }, 100);
-                
-                return true;
-            }
-            return sendMessage(arguments[0]);
-            """
-            result = self.driver.execute_script(js_code, message_text)
-            if result:
-                time.sleep(2)
-                return True
-        except Exception as e:
-            self.log(f"Error en método JS: {e}")
-        
-        # Método 2: Selenium tradicional con ActionChains
+    def process_sending(self, list_to_send, greeting=None, caption=False, navigation="url", compress=False,
+                        pipeline=False, resend_in_doubt=False):
+        out_dir = os.path.dirname(self.excel_path) if self.excel_path else os.getcwd()
+        sessions = [s for s in self.sessions if s.driver]
+        counts = ()
         try:
-            textbox = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]'))
-            )
-            textbox.click()
-            time.sleep(0.5)
-            
-            # Limpiar cualquier texto previo
-            textbox.clear()
-            
-            # Usar ActionChains para escribir
-            actions = ActionChains(self.driver)
-            actions.move_to_element(textbox)
-            actions.click()
-            actions.send_keys(message_text)
-            actions.send_keys(Keys.ENTER)
-            actions.perform()
-            
-            time.sleep(2)
-            return True
+            sent, not_sent = send_and_report(list_to_send, sessions, out_dir, self.log, self.set_progress,
+                                             lambda: self.stop_sending, pacing=self.pacing, greeting=greeting,
+                                             caption=caption, navigation=navigation, compress=compress,
+                                             pipeline=pipeline, resend_in_doubt=resend_in_doubt)
+            counts = (len(sent), len(not_sent))
         except Exception as e:
-            self.log(f"Error en método ActionChains: {e}")
-            
-        return False
+            self.log(f"❌ Error durante el envío: {e}")
+            self.post("sending_error", str(e) or type(e).__name__)
+        finally:
+            # Siempre: si no, los botones quedan deshabilitados y no se puede reintentar
+            self.post("sending_done", *counts)
+
+    def on_close(self):
+        if messagebox.askyesno("Salir", "¿Desea cerrar la aplicación?"):
+            for s in self.sessions:
+                s.quit()
+            self.destroy()
 
-    def send_pdf_attachment(self, pdf_path):
-        """Envía un archivo PDF como adjunto"""
+# ---------------------------
+# Línea de comandos
+# ---------------------------
+
+def load_single_cli(args, log):
+    """Carga el Excel y la carpeta de PDFs de --excel/--pdfs. Devuelve (participantes, saludo) o None."""
+    df, mapping = read_excel_flexible(args.excel)
+    log(f"Excel cargado: {args.excel} (hoja: {df.attrs.get('sheet', '—')}, filas: {len(df)})")
+    df, mapping = prepare_roster(df, mapping)
+    log(f"Mapeo detectado: { {k: (v if v else 'NO_DETECTADA') for k, v in mapping.items()} }")
+    index = PdfFolderIndex(args.pdfs)
+    n_dirs, rescanned = index.refresh()
+    log(f"Índice de PDFs: {len(index)} archivos en {n_dirs} carpetas ({rescanned} releídas).")
+    participants, report = build_participants(df, mapping, [path for path, _, _ in index.files()])
+    for line in match_summary(participants, report, limit=len(report)):
+        log(line)
+    try:
+        return participants, GreetingTemplate(args.saludo, df)
+    except ValueError as e:
+        log(f"❌ {e}")
+        return None
+
+def load_batch_cli(args, log):
+    """Carga todos los eventos bajo --lote. Devuelve (participantes, saludo por evento) o None."""
+    events = discover_events(args.lote)
+    if not events:
+        log(f"❌ No se encontraron eventos ({EVENT_ROSTER_DIR}/ y {EVENT_PDF_DIR}/) en {args.lote}.")
+        return None
+    log(f"🗃️ {len(events)} eventos encontrados en {args.lote}.")
+    participants, templates = [], {}
+    for event, loaded in load_events(events):
+        if isinstance(loaded, Exception):
+            log(f"❌ {event['nombre']}: no se pudo cargar ({loaded}); se omite.")
+            continue
+        df, event_participants, report = loaded
+        log(f"📂 {event['nombre']}: {os.path.basename(event['excel'])}, {len(df)} filas.")
+        for line in match_summary(event_participants, report, limit=len(report)):
+            log(f"   {line}")
         try:
-            # Paso 1: Click en el botón de adjuntar
-            attach_btn_selectors = [
-                '//div[@title="Adjuntar"]',
-                '//button[@data-testid="clip"]',
-                '//span[@data-icon="clip"]/..',
-                '//div[@aria-label="Adjuntar"]'
-            ]
-            
-            attach_btn = None
-            for selector in attach_btn_selectors:
-                try:
-                    attach_btn = self.driver.find_element(By.XPATH, selector)
-                    if attach_btn.is_displayed():
-                        break
-                except:
-                    continue
-            
-            if not attach_btn:
-                self.log("No se encontró el botón de adjuntar")
-                return False
-            
-            attach_btn.click()
-            time.sleep(1)
-            
-            # Paso 2: Localizar el input de archivo y subir
-            file_input_selectors = [
-                '//input[@accept="*"][@type="file"]',
-                '//input[@type="file"]'
-            ]
-            
-            file_input = None
-            for selector in file_input_selectors:
-                try:
-                    file_input = self.driver.find_element(By.XPATH, selector)
-                    if file_input:
-                        break
-                except:
-                    continue
-            
-            if not file_input:
-                self.log("No se encontró el input de archivo")
-                return False
-            
-            # Enviar la ruta del archivo
-            file_input.send_keys(pdf_path)
-            self.log(f"Archivo adjuntado, esperando preview...")
-            time.sleep(3)
-            
-            # Paso 3: Esperar el preview y hacer click en enviar
-            send_btn_selectors = [
-                '//span[@data-icon="send"]/..',
-                '//button[@data-testid="send"]',
-                '//div[@aria-label="Enviar"]',
-                '//span[@data-testid="send"]/..'
-            ]
-            
-            # Intentar múltiples veces encontrar el botón de enviar
-            for attempt in range(5):
-                for selector in send_btn_selectors:
-                    try:
-                        send_btn = self.driver.find_element(By.XPATH, selector)
-                        if send_btn.is_displayed() and send_btn.is_enabled():
-                            send_btn.click()
-                            self.log("Click en botón enviar exitoso")
-                            time.sleep(2)
-                            return True
-                    except:
-                        continue
-                time.sleep(0.5)
-            
-            # Si no funciona con clicks, intentar con JavaScript
-            self.log("Intentando enviar con JavaScript...")
-            js_click = """
-            const sendButtons = document.querySelectorAll('button[data-testid="send"], span[data-icon="send"]');
-            for (let btn of sendButtons) {
-                if (btn.offsetParent !== null) {
-                    if (btn.tagName === 'SPAN') {
-                        btn.parentElement.click();
-                    } else {
-                        btn.click();
-                    }
-                    return true;
-                }
-            }
-            return false;
-            """
-            result = self.driver.execute_script(js_click)
-            if result:
-                time.sleep(2)
-                return True
-            
-            self.log("No se pudo hacer click en el botón de enviar")
-            return False
-            
-        except Exception as e:
-            self.log(f"Error enviando PDF: {e}")
-            return False
+            templates[event["nombre"]] = GreetingTemplate(args.saludo, df)
+        except ValueError as e:
+            log(f"❌ {event['nombre']}: {e}; se omite.")
+            continue
+        participants.extend(event_participants)
+    if not templates:
+        return None
+    return participants, EventGreeting(templates)
 
-    def process_sending(self, list_to_send):
-        total = len(list_to_send)
-        self.progress["maximum"] = total
-        self.progress["value"] = 0
-        sent, not_sent = [], []
-        out_dir = os.path.dirname(self.excel_path) if self.excel_path else os.getcwd()
+def run_cli(args):
+    """Mismo flujo que la ventana (cargar, cruzar, enviar) sin Tk, para tareas programadas.
 
-        for i, p in enumerate(list_to_send, start=1):
-            if self.stop_sending:
-                self.log("🚫 Envío detenido por el usuario.")
-                break
+    Con --lote se cargan todos los eventos de la carpeta y se envían en un solo envío.
+    Chrome arranca en segundo plano mientras se leen los Excel y se indexan los PDFs
+    (salvo con --sin-precarga-navegador o --dry-run).
+    """
+    def log(msg):
+        print(f"{time.strftime('%H:%M:%S')} - {msg}", flush=True)
 
-            name_display = p["display"]
-            num = p["NUM_WA"]
-            pdf = p["PDF_PATH"]
-            tel_digits = re.sub(r"\D", "", str(num))
+    sessions = []
+    if not args.dry_run:
+        sessions = [WhatsAppSession(i, log if args.sesiones == 1 else (lambda m, i=i: log(f"[S{i + 1}] {m}")),
+                                    profile_base=args.perfil, headless=args.sin_ventana)
+                    for i in range(args.sesiones)]
+        for s in sessions:
+            s.lean = not args.perfil_completo
+            s.block_images = args.sin_imagenes
+        if PRELAUNCH_BROWSER and not args.sin_precarga_navegador:
+            for s in sessions:
+                s.launch_async()
+    try:
+        loaded = load_batch_cli(args, log) if args.lote else load_single_cli(args, log)
+        if loaded is None:
+            return 1
+        participants, greeting = loaded
+        selected = [p for p in participants if p["SELECCIONADO"]]
 
-            if not p["ENCONTRADO"] or not pdf or not os.path.exists(pdf):
-                self.log(f"❌ {name_display}: PDF no encontrado.")
-                not_sent.append({"NOMBRE": p["NOMBRES"], "TELEFONO": num, "ESTADO": "PDF_NO"})
-                self.progress["value"] = i
-                continue
+        if args.dry_run:
+            if args.revisar_pdfs:
+                # Solo se revisa: las copias comprimidas se hacen al enviar
+                checks = PdfPreflight().run([p["PDF_PATH"] for p in selected if p["PDF_PATH"]], log=log)
+                for line in preflight_summary(checks, limit=len(checks)):
+                    log(line)
+            groups, issues = plan_recipients(selected)
+            for line in plan_summary(groups, issues, limit=len(issues)):
+                log(line)
+            for p in participants:
+                pdf = os.path.basename(p["PDF_PATH"]) if p["PDF_PATH"] else "-"
+                event = f"[{p['EVENTO']}] " if "EVENTO" in p else ""
+                print(f"{p['COINCIDENCIA']:<9} {p['CONFIANZA']:>4.0%}  {p['NUM_WA']:<13} {event}{p['display']}  ←  {pdf}")
+            return 0
 
-            try:
-                # Abrir chat
-                self.log(f"📱 Abriendo chat de {name_display}...")
-                url = f"https://web.whatsapp.com/send?phone={tel_digits}&app_absent=0"
-                self.driver.get(url)
-                
-                # Esperar a que cargue el chat
-                WebDriverWait(self.driver, 20).until(
-                    EC.presence_of_element_located((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]'))
-                )
-                time.sleep(2)
-
-                # Enviar mensaje de saludo
-                message_text = f"Hola {p['NOMBRES']}, te envío tu certificado. Saludos."
-                self.log(f"💬 Enviando mensaje a {name_display}...")
-                
-                if self.send_text_message(message_text):
-                    self.log(f"✅ Mensaje enviado a {name_display}")
-                    time.sleep(2)
-                else:
-                    self.log(f"⚠️ No se pudo enviar el mensaje a {name_display}")
+        for s in sessions:
+            s.open()
+        ready = [s for s in sessions if s.wait_login(args.espera_login)]
+        if not ready:
+            log("Ninguna sesión de WhatsApp Web inició sesión; se cancela el envío.")
+            return 1
 
-                # Enviar PDF
-                self.log(f"📎 Adjuntando PDF para {name_display}...")
-                if self.send_pdf_attachment(pdf):
-                    self.log(f"✅ PDF enviado exitosamente a {name_display}")
-                    sent.append({"NOMBRE": p["NOMBRES"], "TELEFONO": num, "ESTADO": "ENVIADO"})
-                else:
-                    self.log(f"❌ Error al enviar PDF a {name_display}")
-                    not_sent.append({"NOMBRE": p["NOMBRES"], "TELEFONO": num, "ESTADO": "ERROR_PDF"})
+        # En lote, cada evento recibe sus reportes en su ArchivoXLSM; aquí quedan las métricas
+        out_dir = args.salida or (args.lote if args.lote else os.path.dirname(os.path.abspath(args.excel)))
+        stop = threading.Event()
+        outcome = {}
 
-            except Exception as e:
-                self.log(f"❌ Error con {name_display}: {e}")
-                not_sent.append({"NOMBRE": p["NOMBRES"], "TELEFONO": num, "ESTADO": f"ERROR: {str(e)[:50]}"})
+        pacing = args.pacing
 
-            self.progress["value"] = i
-            time.sleep(3)  # Pausa entre envíos
+        def progress(done, total, eta=None):
+            if done == total or done % 10 == 0:
+                log(f"Progreso: {done}/{total}" + (f" · faltan {format_eta(eta)}" if done < total else ""))
 
-        # Guardar resultados
-        self.btn_send.config(state="normal")
-        self.btn_stop.config(state="disabled")
-        
-        if sent:
-            pd.DataFrame(sent).to_excel(os.path.join(out_dir, "ENVIADOS.xlsx"), index=False)
-        if not_sent:
-            pd.DataFrame(not_sent).to_excel(os.path.join(out_dir, "NO_ENVIADOS.xlsx"), index=False)
-        
-        self.log(f"🗂️ Resultados guardados en {out_dir}")
-        messagebox.showinfo("Proceso finalizado", f"✅ Enviados: {len(sent)} | ❌ No enviados: {len(not_sent)}")
+        def worker():
+            outcome["result"] = send_and_report(selected, ready, out_dir, log, progress, stop.is_set,
+                                                pacing=pacing, prometheus_path=args.metricas_prometheus,
+                                                greeting=greeting, caption=args.saludo_en_leyenda,
+                                                navigation=args.navegacion, compress=args.comprimir_pdfs,
+                                                pipeline=args.precargar_chat,
+                                                resend_in_doubt=args.reenviar_dudosos)
 
-    def on_close(self):
-        if messagebox.askyesno("Salir", "¿Desea cerrar la aplicación?"):
+        t = threading.Thread(target=worker, daemon=True)
+        t.start()
+        while t.is_alive():
             try:
-                if self.driver:
-                    self.driver.quit()
-            except:
-                pass
-            self.destroy()
+                t.join(0.5)
+            except KeyboardInterrupt:
+                log("Interrupción recibida: se termina el envío en curso y se guardan los resultados...")
+                stop.set()
+        sent, not_sent = outcome.get("result", ([], selected))
+        log(f"✅ Enviados: {len(sent)} | ❌ No enviados: {len(not_sent)}")
+        return 0 if not not_sent else 2
+    finally:
+        for s in sessions:
+            s.quit()
 
-if __name__ == "__main__":
-    app = App()
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Envío de certificados por WhatsApp. Sin argumentos abre la ventana.")
+    parser.add_argument("--excel", help="Excel con NOMBRES, APELLIDOS y TELEFONO")
+    parser.add_argument("--pdfs", help="carpeta con los certificados (se recorre con subcarpetas)")
+    parser.add_argument("--lote", metavar="CARPETA",
+                        help=f"envía todos los eventos de la carpeta (<evento>/{EVENT_ROSTER_DIR}/*.xlsx y "
+                             f"<evento>/{EVENT_PDF_DIR}/), con los reportes en el {EVENT_ROSTER_DIR} de cada uno")
+    parser.add_argument("--perfil", help=f"carpeta del perfil de Chrome (por defecto ./{PROFILE_BASENAME})")
+    parser.add_argument("--sesiones", type=int, default=1, choices=range(1, MAX_SESSIONS + 1),
+                        help="cantidad de navegadores en paralelo")
+    parser.add_argument("--salida", help="carpeta para ENVIADOS/NO_ENVIADOS (por defecto, la del Excel; "
+                                         "con --lote, solo las métricas)")
+    parser.add_argument("--espera-login", type=int, default=180, help="segundos para detectar la sesión iniciada")
+    parser.add_argument("--ritmo", type=float, default=PACING["rate"],
+                        help="mensajes por minuto al empezar, por sesión (se ajusta solo según los fallos)")
+    parser.add_argument("--cuota-hora", type=int, default=PACING["hourly_quota"],
+                        help="máximo de envíos por hora y por sesión")
+    parser.add_argument("--ritmo-minimo", type=float, default=PACING["min_rate"],
+                        help="piso al que puede bajar el ritmo tras fallos (mensajes por minuto)")
+    parser.add_argument("--ritmo-maximo", type=float, default=PACING["max_rate"],
+                        help="techo al que puede volver a subir el ritmo (mensajes por minuto)")
+    parser.add_argument("--variacion", type=float, default=PACING["jitter"],
+                        help="variación aleatoria de cada espera (0.3 = ±30 %%)")
+    parser.add_argument("--factor-bajada", type=float, default=PACING["backoff"],
+                        help="factor por el que se multiplica el ritmo tras fallos")
+    parser.add_argument("--factor-recuperacion", type=float, default=PACING["recovery"],
+                        help="factor por el que se multiplica el ritmo al recuperarse")
+    parser.add_argument("--exitos-recuperacion", type=int, default=PACING["recover_after"],
+                        help="envíos seguidos sin fallos antes de subir el ritmo")
+    parser.add_argument("--saludo", default=DEFAULT_GREETING,
+                        help="plantilla del mensaje; {COLUMNA} toma el valor de cualquier columna del Excel")
+    parser.add_argument("--saludo-en-leyenda", action="store_true",
+                        help="envía el saludo como leyenda del PDF (un solo mensaje por destinatario)")
+    parser.add_argument("--navegacion", choices=("url", "app"), default="url",
+                        help="app: abre los chats ya existentes desde el buscador, sin recargar la página")
+    parser.add_argument("--precargar-chat", action="store_true",
+                        help="abre el chat siguiente apenas se confirma cada PDF, antes de la espera del "
+                             "ritmo (solo acelera cuando el ritmo es lo que limita)")
+    parser.add_argument("--comprimir-pdfs", action="store_true",
+                        help=f"envía una copia comprimida de los PDFs de más de {PDF_COMPRESS_ABOVE_MB} MB (requiere pypdf)")
+    parser.add_argument("--reenviar-dudosos", action="store_true",
+                        help="reenvía también a quienes quedaron en duda en un envío anterior "
+                             "(PDF en camino o sin confirmar); puede duplicar el certificado")
+    parser.add_argument("--metricas-prometheus", metavar="ARCHIVO",
+                        help="además de METRICAS_*.json/.csv, escribe las métricas en formato Prometheus")
+    parser.add_argument("--sin-ventana", action="store_true", help="Chrome en modo headless")
+    parser.add_argument("--sin-imagenes", action="store_true",
+                        help="Chrome no descarga imágenes (menos memoria y red por sesión)")
+    parser.add_argument("--sin-precarga-navegador", action="store_true",
+                        help="no arranca Chrome hasta que haga falta (también en la ventana); "
+                             "útil si solo se va a revisar el cruce")
+    parser.add_argument("--perfil-completo", action="store_true",
+                        help="no poda las cachés del perfil ni usa las opciones livianas de Chrome")
+    parser.add_argument("--dry-run", action="store_true", help="solo muestra el cruce Excel ↔ PDFs, no envía")
+    parser.add_argument("--revisar-pdfs", action="store_true",
+                        help="con --dry-run, además revisa los PDFs (legibles, cifrados, tamaño) sin comprimir nada")
+    args = parser.parse_args(argv)
+    try:
+        args.pacing = check_pacing({"rate": args.ritmo, "hourly_quota": args.cuota_hora, "min_rate": args.ritmo_minimo,
+                                    "max_rate": args.ritmo_maximo, "jitter": args.variacion,
+                                    "backoff": args.factor_bajada, "recovery": args.factor_recuperacion,
+                                    "recover_after": args.exitos_recuperacion})
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.lote:
+        if args.excel or args.pdfs:
+            parser.error("--lote no se combina con --excel/--pdfs")
+        return run_cli(args)
+    if args.excel or args.pdfs:
+        if not (args.excel and args.pdfs):
+            parser.error("--excel y --pdfs deben indicarse juntos")
+        return run_cli(args)
+    if tk is None:
+        parser.error("tkinter no está disponible: use --excel y --pdfs")
+    app = App(prelaunch=PRELAUNCH_BROWSER and not args.sin_precarga_navegador)
     app.protocol("WM_DELETE_WINDOW", app.on_close)
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # ejecutable empaquetado: los procesos de PdfPreflight
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""Simulador local de WhatsApp Web para medir y probar el envío sin tocar web.whatsapp.com.
+
+Sirve una página con el mismo DOM del que depende enviar_whatsapp.py: buscador
+(data-tab="3"), caja de texto (data-tab="10"), botón de enviar texto (data-tab="11"),
+botón de adjuntar, input de archivo, vista previa con leyenda y span[data-icon="send"] y
+burbujas salientes con reloj → marca de enviado. Cada paso tiene una demora
+configurable y se pueden inyectar fallos con cierta probabilidad. Como WhatsApp Web,
+solo una pestaña por navegador queda activa: al abrir otra, la anterior pasa a «Usar
+aquí» y lo que tenía en curso no llega.
+
+    python simulador_whatsapp.py --puerto 8765 --fallo-chat 0.1
+    # y en el navegador: http://127.0.0.1:8765/send?phone=51987654321
+
+Para medir el envío completo ver benchmark_envio.py.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Demora de cada paso en milisegundos; cada chat la varía ±50 %
+DELAYS = {
+    "login": 300,     # aparece el buscador (sesión iniciada)
+    "search": 300,    # el buscador abre un chat existente
+    "chat": 800,      # carga del chat tras /send?phone=
+    "text": 150,      # el saludo sale y la caja de texto se vacía
+    "attach": 100,    # el menú de adjuntar muestra el input de archivo
+    "preview": 400,   # la vista previa muestra el botón enviar
+    "upload": 700,    # la vista previa se cierra y aparece la burbuja
+    "ack": 500,       # la burbuja pasa del reloj a la marca de enviado
+}
+
+# Probabilidad de cada fallo inyectado, por chat abierto
+FAILURES = {
+    "chat": 0.0,         # el chat nunca carga (TIMEOUT_CHAT)
+    "invalid": 0.0,      # WhatsApp dice que el número no es válido (NUMERO_INVALIDO)
+    "attach": 0.0,       # no hay botón de adjuntar (ERROR_ADJUNTO)
+    "send_button": 0.0,  # el botón enviar de la vista previa no responde (ERROR_BOTON_ENVIAR)
+    "ack": 0.0,          # los mensajes se quedan con el reloj (SIN_CONFIRMAR)
+}
+
+PAGE = r"""<!doctype html>
+<html lang="es"><head><meta charset="utf-8"><title>WhatsApp (simulador)</title>
+<style>
+body { font-family: sans-serif; margin: 0; display: flex; height: 100vh; }
+#side { width: 260px; border-right: 1px solid #ccc; padding: 8px; }
+#main { flex: 1; display: flex; flex-direction: column; }
+#conversation { flex: 1; overflow-y: auto; padding: 8px; }
+.message-out { background: #d9fdd3; margin: 4px 0 4px auto; padding: 6px; max-width: 60%; }
+footer { display: flex; gap: 6px; padding: 8px; border-top: 1px solid #ccc; }
+div[contenteditable] { flex: 1; border: 1px solid #999; min-height: 24px; padding: 4px; }
+#preview { position: absolute; inset: 40px 40px auto 300px; background: #fff; border: 1px solid #999; padding: 20px; }
+div[role="dialog"] { position: absolute; top: 40%; left: 35%; background: #fff; border: 1px solid #999; padding: 20px; }
+</style></head>
+<body><div id="side"></div><div id="main"></div>
+<script>
+let PLAN = __PLAN__;
+const side = document.getElementById('side'), main = document.getElementById('main');
+let seq = 0;
+let inactive = false;
+
+// Una sola pestaña activa por navegador: la que abre después deja a las demás en «Usar aquí»
+const tabs = new BroadcastChannel('whatsapp_simulador');
+tabs.onmessage = () => {
+    if (inactive) return;
+    report('pestana_inactiva');
+    inactive = true;
+    side.innerHTML = '';
+    main.innerHTML = '';
+    document.querySelectorAll('#preview, [role="dialog"]').forEach(e => e.remove());
+    const screen = el(`<div><p>WhatsApp está abierto en otra ventana. Haz clic en «Usar aquí» para usarlo en esta ventana.</p>
+        <div role="button">Usar aquí</div></div>`);
+    screen.querySelector('[role="button"]').addEventListener('click', () => location.reload());
+    main.appendChild(screen);
+};
+tabs.postMessage('activa');
+
+function report(tipo) {
+    if (inactive) return;
+    // Lo que llega a un grupo se cuenta aparte: el envío nunca debería escribir ahí
+    if (PLAN.group) tipo = `grupo_${tipo}`;
+    fetch('/evento', {method: 'POST', body: JSON.stringify({tipo: tipo, phone: PLAN.phone})});
+}
+
+function chatJid() {
+    return PLAN.group ? `120363${PLAN.chat_id}@g.us` : `${PLAN.phone}@c.us`;
+}
+
+function el(html) {
+    const t = document.createElement('template');
+    t.innerHTML = html.trim();
+    return t.content.firstChild;
+}
+
+function addBubble(text) {
+    if (inactive) return;
+    const conv = document.getElementById('conversation');
+    const row = el(`<div data-id="true_${chatJid()}_${PLAN.chat_id}_${++seq}"><div class="message-out">
+        <span></span> <span data-icon="msg-time"></span></div></div>`);
+    row.querySelector('span').textContent = text;
+    conv.appendChild(row);
+    if (PLAN.ack) {
+        setTimeout(() => row.querySelector('span[data-icon]').setAttribute('data-icon', 'msg-check'), PLAN.delays.ack);
+    }
+}
+
+function sendText() {
+    const box = document.querySelector('div[contenteditable="true"][data-tab="10"]');
+    const text = box.textContent.trim();
+    if (!text) return;
+    setTimeout(() => { box.textContent = ''; addBubble(text); report('texto'); }, PLAN.delays.text);
+}
+
+function openAttach() {
+    if (document.querySelector('input[type="file"]')) return;
+    setTimeout(() => {
+        const input = el('<input type="file" accept="*" multiple>');
+        input.addEventListener('change', () => showPreview(input));
+        main.appendChild(input);
+    }, PLAN.delays.attach);
+}
+
+function showPreview(input) {
+    const names = input.files.length ? Array.from(input.files, f => f.name) : ['archivo'];
+    input.remove();
+    setTimeout(() => {
+        const preview = el(`<div id="preview"><p></p>
+            <div contenteditable="true" aria-label="Añade un comentario"></div>
+            <div aria-label="Enviar" role="button"><span data-icon="send">Enviar ➤</span></div></div>`);
+        preview.querySelector('p').textContent = names.join(', ');
+        preview.querySelector('[role="button"]').addEventListener('click', () => {
+            if (!PLAN.send_button) return;
+            const caption = preview.querySelector('[contenteditable]').textContent.trim();
+            setTimeout(() => {
+                preview.remove();
+                // Como WhatsApp: un mensaje por archivo, la leyenda va en el primero
+                names.forEach((name, i) => {
+                    addBubble(caption && i === 0 ? `${name}\n${caption}` : name);
+                    report(caption && i === 0 ? 'archivo_con_leyenda' : 'archivo');
+                });
+            }, PLAN.delays.upload);
+        });
+        document.body.appendChild(preview);
+    }, PLAN.delays.preview);
+}
+
+function openChat() {
+    if (inactive) return;
+    main.innerHTML = '';
+    document.querySelectorAll('#preview, [role="dialog"]').forEach(e => e.remove());
+    main.appendChild(el('<div id="conversation"></div>'));
+    if (PLAN.group) {
+        // Grupo donde el número escribió: su id de participante va al final del data-id
+        document.getElementById('conversation').appendChild(el(
+            `<div data-id="false_${chatJid()}_anterior_${PLAN.phone}@c.us"><div class="message-in">Hola a todos</div></div>`));
+    } else if (PLAN.existing) {
+        document.getElementById('conversation').appendChild(el(
+            `<div data-id="false_${PLAN.phone}@c.us_anterior"><div class="message-in">Gracias</div></div>`));
+    }
+    const footer = el('<footer></footer>');
+    if (PLAN.attach) {
+        const clip = el('<div title="Adjuntar" role="button"><span data-icon="clip">📎</span></div>');
+        clip.addEventListener('click', openAttach);
+        footer.appendChild(clip);
+    }
+    const box = el('<div contenteditable="true" data-tab="10" role="textbox"></div>');
+    box.addEventListener('keydown', e => { if (e.key === 'Enter') { e.preventDefault(); sendText(); } });
+    footer.appendChild(box);
+    const btn = el('<button data-tab="11">➤</button>');
+    btn.addEventListener('click', sendText);
+    footer.appendChild(btn);
+    main.appendChild(footer);
+    report('chat');
+}
+
+function search(box) {
+    const query = box.textContent.replace(/\D/g, '');
+    report('busqueda');
+    fetch(`/plan?buscar=${query}`).then(r => r.json()).then(plan => {
+        if (plan.chat !== 'ok' || inactive) return;   // sin chat existente: no pasa nada
+        PLAN = plan;
+        setTimeout(openChat, plan.delays.search);
+    });
+}
+
+setTimeout(() => {
+    if (inactive) return;
+    const box = el('<div contenteditable="true" data-tab="3" title="Buscar"></div>');
+    box.addEventListener('keydown', e => { if (e.key === 'Enter') { e.preventDefault(); search(box); } });
+    side.appendChild(box);
+}, PLAN.delays.login);
+if (PLAN.phone) {
+    if (PLAN.chat === 'invalid') {
+        setTimeout(() => document.body.appendChild(el(
+            '<div role="dialog"><div>El número de teléfono compartido a través de la dirección URL no es válido.</div></div>')),
+            PLAN.delays.chat);
+        report('invalido');
+    } else if (PLAN.chat === 'ok') {
+        setTimeout(openChat, PLAN.delays.chat);
+    }
+}
+</script></body></html>
+"""
+
+
+class WhatsAppStandIn:
+    """Servidor HTTP del simulador. Las decisiones (demoras, fallos) salen de un RNG con semilla.
+
+    existing es la probabilidad de que un número ya tenga chat (el buscador lo encuentra);
+    los números abiertos antes con /send también cuentan como chats existentes. groups es la
+    probabilidad de que el buscador abra, en cambio, un grupo donde ese número escribió
+    (los mensajes que lleguen ahí se cuentan como grupo_*).
+    stats cuenta lo que la página recibió: chats abiertos, textos, archivos, números inválidos
+    y pestañas que quedaron inactivas por abrir otra.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delays=None, failures=None, invalid_numbers=(), seed=0,
+                 existing=0.0, groups=0.0):
+        self.delays = dict(DELAYS, **(delays or {}))
+        self.existing = existing
+        self.groups = groups
+        self.history = set()
+        self.failures = dict(FAILURES, **(failures or {}))
+        self.invalid_numbers = set(invalid_numbers)
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.chats = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def plan(self, phone, query=None):
+        """Decide qué le va a pasar a este chat: demoras y fallos inyectados.
+
+        Con query (búsqueda desde el buscador) solo se abre un chat que ya exista.
+        """
+        with self.lock:
+            rng, fail = self.rng, self.failures
+            self.chats += 1
+            existing = phone in self.history
+            group = False
+            if query is not None:
+                phone = next((h for h in self.history if query and h.endswith(query)), "")
+                existing = bool(phone)
+                if not phone and len(query) >= 8 and rng.random() < self.existing:
+                    phone, existing = ("51" + query if len(query) == 9 else query), True
+                chat = "ok" if existing else "not_found"
+                group = bool(query) and len(query) >= 8 and rng.random() < self.groups
+                if group and not phone:
+                    phone, chat = ("51" + query if len(query) == 9 else query), "ok"
+            elif not phone:
+                chat = "none"
+            elif phone in self.invalid_numbers or rng.random() < fail["invalid"]:
+                chat = "invalid"
+            elif rng.random() < fail["chat"]:
+                chat = "timeout"
+            else:
+                chat = "ok"
+                existing = existing or rng.random() < self.existing
+            if chat == "ok" and not group:
+                self.history.add(phone)
+            return {
+                "phone": phone,
+                "chat_id": self.chats,
+                "chat": chat,
+                "existing": existing,
+                "group": group,
+                "attach": rng.random() >= fail["attach"],
+                "send_button": rng.random() >= fail["send_button"],
+                "ack": rng.random() >= fail["ack"],
+                "delays": {k: int(v * rng.uniform(0.5, 1.5)) for k, v in self.delays.items()},
+            }
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/estadisticas":
+                    with standin.lock:
+                        body = json.dumps(dict(standin.stats)).encode("utf-8")
+                    return self._send(body, "application/json")
+                if url.path == "/plan":
+                    query = parse_qs(url.query).get("buscar", [""])[0]
+                    return self._send(json.dumps(standin.plan("", query)).encode("utf-8"), "application/json")
+                if url.path not in ("/", "/send"):
+                    return self.send_error(404)
+                phone = parse_qs(url.query).get("phone", [""])[0] if url.path == "/send" else ""
+                page = PAGE.replace("__PLAN__", json.dumps(standin.plan(phone)))
+                self._send(page.encode("utf-8"), "text/html; charset=utf-8")
+
+            def do_POST(self):
+                if self.path != "/evento":
+                    return self.send_error(404)
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with standin.lock:
+                    standin.stats[data.get("tipo", "?")] += 1
+                self._send(b"{}", "application/json")
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_arguments(parser):
+    """Opciones de demoras y fallos, compartidas con benchmark_envio.py."""
+    parser.add_argument("--semilla", type=int, default=0, help="semilla de demoras y fallos")
+    parser.add_argument("--chats-existentes", type=float, default=0.0,
+                        help="probabilidad de que un número ya tenga chat (lo encuentra el buscador)")
+    parser.add_argument("--chats-grupo", type=float, default=0.0,
+                        help="probabilidad de que el buscador abra un grupo donde escribió el número")
+    parser.add_argument("--demora", action="append", default=[], metavar="PASO=MS",
+                        help=f"demora de un paso en ms ({', '.join(DELAYS)}); se puede repetir")
+    for name, flag in (("chat", "--fallo-chat"), ("invalid", "--fallo-numero"), ("attach", "--fallo-adjuntar"),
+                       ("send_button", "--fallo-boton-enviar"), ("ack", "--fallo-confirmacion")):
+        parser.add_argument(flag, dest=f"fallo_{name}", type=float, default=FAILURES[name],
+                            help="probabilidad de este fallo por chat (0..1)")
+
+
+def standin_from_args(args, **kwargs):
+    delays = {}
+    for item in args.demora:
+        step, _, ms = item.partition("=")
+        if step not in DELAYS or not ms.isdigit():
+            raise SystemExit(f"--demora inválida: {item} (use PASO=MS con PASO en {', '.join(DELAYS)})")
+        delays[step] = int(ms)
+    failures = {name: getattr(args, f"fallo_{name}") for name in FAILURES}
+    return WhatsAppStandIn(delays=delays, failures=failures, seed=args.semilla, existing=args.chats_existentes,
+                           groups=args.chats_grupo, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador local de WhatsApp Web.")
+    parser.add_argument("--puerto", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    standin = standin_from_args(args, port=args.puerto)
+    print(f"Simulador en {standin.url} (Ctrl+C para salir)")
+    try:
+        standin.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())